@@ -0,0 +1,52 @@
+from typing import Optional
+from pydantic import BaseModel, Field
+from categories import CategoryEnum
+
+# Tools offered to the model in tool-calling mode (AGENT_MODE=tools). The agent
+# executes them itself; see CustomerSupportAgent.ask_with_tools.
+
+
+class SqlLookup(BaseModel):
+    question: str = Field(..., description="The customer's question about orders or their account, standalone.")
+    order_id: Optional[int] = Field(None, description="Numeric order id, if the customer gave one.")
+    order_number: Optional[str] = Field(None, description="Order number such as ORD-..., if given.")
+    user_id: Optional[int] = Field(None, description="Customer/user id, if given.")
+    sql: Optional[str] = Field(
+        None,
+        description="One read-only PostgreSQL SELECT that answers the question, written against the "
+                    "schema in the system prompt (LIMIT 20). Not needed when an id above is enough.",
+    )
+
+
+class ProductSearch(BaseModel):
+    query: str = Field(..., description="What the customer is looking for, as a search query.")
+    category: Optional[CategoryEnum] = Field(None, description="Product category, if the customer named one.")
+    min_price: Optional[float] = Field(None, description="Lowest acceptable price.")
+    max_price: Optional[float] = Field(None, description="Highest acceptable price.")
+    popular: bool = Field(False, description="True when asking for best sellers or popular products.")
+
+
+class DirectAnswer(BaseModel):
+    answer: str = Field(..., description="The complete answer to give the customer.")
+
+
+def _tool(name, description, schema):
+    return {
+        "type": "function",
+        "function": {"name": name, "description": description, "parameters": schema.model_json_schema()},
+    }
+
+
+TOOLS = [
+    _tool("sql_lookup", "Look up orders, order status, order contents, shipments or account data.", SqlLookup),
+    _tool("product_search", "Search the product catalog for information or recommendations.", ProductSearch),
+    _tool("direct_answer", "Answer directly: greetings, policies and anything needing no store data.", DirectAnswer),
+]
+
+TOOL_ARGS = {"sql_lookup": SqlLookup, "product_search": ProductSearch, "direct_answer": DirectAnswer}
+
+SYSTEM_PROMPT = """You are a customer support assistant for an electronics store.
+Call exactly one tool for every message: sql_lookup for orders and accounts,
+product_search for products, direct_answer when no store data is needed.
+Fill in every argument the customer gave (order id or number, category, price bounds).
+For sql_lookup questions an id doesn't answer, write the query in its sql argument."""
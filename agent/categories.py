@@ -0,0 +1,22 @@
+from enum import Enum
+
+# The product categories, shared by add_categories.py (what products are
+# labeled with) and agent_tools.py (what the agent may filter on).
+class CategoryEnum(str, Enum):
+    smartphones = "smartphones"
+    laptops = "laptops"
+    watches = "watches"
+    accessories = "accessories"
+    tvs = "tvs"
+    monitors = "monitors"
+    audio = "audio"
+    wearables = "wearables"
+    networking = "networking"
+    printers = "printers"
+    cameras = "cameras"
+    drones = "drones"
+    storage = "storage"
+    peripherals = "peripherals"
+    smart_home = "smart_home"
+    consoles = "consoles"
+    other = "other"
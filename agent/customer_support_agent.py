@@ -1,23 +1,54 @@
 import os
+import re
+import math
+import threading
 from typing import Optional, Dict, Any
-from qdrant_client.models import Filter, FieldCondition, MatchValue
-from langchain_openai import ChatOpenAI
+from sqlalchemy import create_engine, inspect
+from qdrant_client.models import Filter, FieldCondition, MatchValue, Range
+from pydantic import ValidationError
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from langchain.schema import BaseOutputParser
-from langchain_community.utilities import SQLDatabase
 from langchain_experimental.sql import SQLDatabaseChain
+from langchain.chains.sql_database.prompt import SQL_PROMPTS, PROMPT as SQL_PROMPT
+from sql_workload import WorkloadSQLDatabase
+from support_views import SUPPORT_TABLES, PROMPT_HINT as SUPPORT_PROMPT_HINT
+from session_memory import SessionMemory
+from model_tiers import STAGE_DEFAULTS, stage_config, stage_llm, stats as stage_stats
+from speculation import Speculator
+import openai_client
+from agent_tools import TOOLS, TOOL_ARGS, SYSTEM_PROMPT as TOOLS_SYSTEM_PROMPT, SqlLookup, ProductSearch
 from dotenv import load_dotenv
 load_dotenv()
 
+# questions asking for best sellers get re-ranked by sales payload
+POPULARITY_KEYWORDS = [
+    "best selling", "best-selling", "bestseller", "best seller",
+    "top selling", "top-selling", "most sold", "most popular",
+    "popular", "trending",
+]
+POPULARITY_WEIGHT = float(os.getenv("POPULARITY_WEIGHT", "0.5"))
+POPULARITY_CANDIDATES = 20
+
+# "route": router call, then the handler's call(s); "tools": one tool-calling call
+AGENT_MODE = os.getenv("AGENT_MODE", "route")
+
+# start product retrieval alongside the router call, keep it if the route is vector
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "1") == "1"
+
+# tables the SQL chain may query (plus the support summaries, when built)
+SQL_TABLES = ["users", "orders", "products", "order_items"]
+
+# sql_lookup runs the query the tool call carries only if it is a single read
+READ_ONLY_SQL = re.compile(r"\s*(select|with)\b[^;]*;?\s*$", re.IGNORECASE)
+
 try:
-    from qdrant_setup import vectorstore
+    from qdrant_setup import vectorstore as default_vectorstore
     print("Vectorstore imported successfully")
-    VECTORSTORE_AVAILABLE = True
 except ImportError as e:
     print(f"Vectorstore import failed: {e}")
-    vectorstore = None
-    VECTORSTORE_AVAILABLE = False
+    default_vectorstore = None
 
 try:
     from db import get_connection
@@ -29,18 +60,47 @@ except ImportError as e:
     DB_CONNECTION_AVAILABLE = False
 
 class CustomerSupportAgent:
-    def __init__(self):
-        """Initialize the customer support agent with available components"""
+    def __init__(self, llms: Optional[Dict[str, Any]] = None, vectorstore=None, db_url: Optional[str] = None):
+        """
+        Initialize the customer support agent with available components.
+        llms ({stage: chat model} for every stage), vectorstore and db_url replace
+        the configured backends, e.g. with the local stand-ins in loadtest.py.
+        """
         print("Initializing Customer Support Agent...")
         
         self._setup_environment()
         
-        # Initialize LLM
-        self.llm = ChatOpenAI(model="gpt-4", temperature=0)
-        print("LLM initialized")
+        # Initialize LLMs, one per stage (see model_tiers.py)
+        if llms:
+            self.llms = dict(llms)
+            print(f"Using provided LLMs for {', '.join(self.llms)}")
+        else:
+            self.llms = {stage: stage_llm(stage) for stage in STAGE_DEFAULTS}
+            for stage in STAGE_DEFAULTS:
+                model, fallback, timeout = stage_config(stage)
+                print(f"LLM for {stage}: {model} ({timeout:.0f}s, fallback {fallback or 'none'})")
+        self.llm = self.llms["general"]
+        self._vectorstore = vectorstore if vectorstore is not None else default_vectorstore
+        self._db_url = db_url
+
+        # per-session history, kept under a token budget by rolling summaries
+        self.memory = SessionMemory(summarize=lambda prompt: self.llms["memory"].invoke(prompt).content)
+
+        self.speculator = Speculator() if SPECULATIVE_RETRIEVAL else None
+
+        # what went wrong in the request this thread is answering, see respond()
+        self._request = threading.local()
+
+        # tool-calling mode: one call picks the tool and fills in its arguments
+        self.tool_llm = None
+        if AGENT_MODE == "tools":
+            self.tool_llm = self.llms["agent"].bind_tools(TOOLS) if llms else stage_llm("agent", tools=TOOLS)
+        print(f"Agent mode: {AGENT_MODE}")
         
         # Initialize components
         self.sql_chain = None
+        self.sql_schema = ""
+        self.support_views = False
         self.vector_chain = None
         self.vectorstore_retriever = None
         
@@ -81,28 +141,41 @@ class CustomerSupportAgent:
     
     def _setup_sql_chain(self):
         """Setup PostgreSQL database chain"""
-        if not DB_CONNECTION_AVAILABLE:
+        if not self._db_url and not DB_CONNECTION_AVAILABLE:
             print("Database connection not available - SQL queries disabled")
             return
         
         try:
             # Check for database URL
-            db_url = os.getenv("DATABASE_URL")
+            db_url = self._db_url or os.getenv("DATABASE_URL")
             if not db_url:
                 print("DATABASE_URL not configured - SQL queries disabled")
                 return
             
-            # Test connection
-            conn = get_connection()
-            if not conn:
-                print("Database connection failed - SQL queries disabled")
-                return
+            # Test connection (a provided db_url is tested by SQLDatabase itself)
+            if not self._db_url:
+                conn = get_connection()
+                if not conn:
+                    print("Database connection failed - SQL queries disabled")
+                    return
             
             # Initialize SQL components
-            db = SQLDatabase.from_uri(db_url)
+            # logs generated SQL and timings for sql_workload.py's index advisor
+            # only the store tables and support summaries go in the prompt;
+            # the sync/outbox/cache tables would just invite wrong queries
+            engine = create_engine(db_url)
+            existing = set(inspect(engine).get_table_names())
+            support = [t for t in SUPPORT_TABLES if t in existing]
+            db = WorkloadSQLDatabase(engine, include_tables=[*SQL_TABLES, *support])
+            self.support_views = support == SUPPORT_TABLES
+            # tools mode writes sql_lookup queries in the tool call itself
+            if self.tool_llm:
+                hint = SUPPORT_PROMPT_HINT if self.support_views else ""
+                self.sql_schema = f"Database schema for sql_lookup:\n{hint}{db.get_table_info()}"
             self.sql_chain = SQLDatabaseChain.from_llm(
-                llm=self.llm,
+                llm=self.llms["sql"],
                 db=db,
+                prompt=self._sql_prompt(db),
                 verbose=True,
                 return_intermediate_steps=True,
             )
@@ -112,15 +185,26 @@ class CustomerSupportAgent:
             print(f"SQL setup failed: {e}")
             self.sql_chain = None
     
+    def _sql_prompt(self, db):
+        """Dialect prompt, pointed at the support summary tables when they exist"""
+        base = SQL_PROMPTS.get(db.dialect, SQL_PROMPT)
+        if not self.support_views:
+            return base
+        print("Support summary tables found - preferring them for SQL queries")
+        return PromptTemplate(
+            input_variables=base.input_variables,
+            template=SUPPORT_PROMPT_HINT + base.template,
+        )
+    
     def _setup_vector_chain(self):
         """Setup Qdrant vectorstore chain"""
-        if not VECTORSTORE_AVAILABLE:
+        if self._vectorstore is None:
             print("Vectorstore not available - vector search disabled")
             return
         
         try:
             # Setup retriever
-            self.vectorstore_retriever = vectorstore.as_retriever(
+            self.vectorstore_retriever = self._vectorstore.as_retriever(
                 search_kwargs={"k": 3}
             )
             
@@ -144,13 +228,13 @@ Answer:"""
             
             try:
                 # modern approach first
-                self.vector_chain = vector_prompt | self.llm | StrOutputParser()
+                self.vector_chain = vector_prompt | self.llms["vector"] | StrOutputParser()
                 print("Vector search chain initialized (modern approach)")
             except Exception:
                 # fallback to LLMChain if modern approach fails
                 from langchain.chains import LLMChain
                 self.vector_chain = LLMChain(
-                    llm=self.llm,
+                    llm=self.llms["vector"],
                     prompt=vector_prompt
                 )
                 print("Vector search chain initialized (legacy approach)")
@@ -194,13 +278,13 @@ Respond with only: sql, vector, or general"""
             from langchain.schema.runnable import RunnablePassthrough
             from langchain.schema.output_parser import StrOutputParser
             
-            self.router_chain = router_prompt | self.llm | RouterParser()
+            self.router_chain = router_prompt | self.llms["router"] | RouterParser()
             print("Question router initialized (modern approach)")
         except Exception:
             # Fallback to LLMChain
             from langchain.chains import LLMChain
             self.router_chain = LLMChain(
-                llm=self.llm,
+                llm=self.llms["router"],
                 prompt=router_prompt,
                 output_parser=RouterParser()
             )
@@ -261,75 +345,87 @@ Respond with only: sql, vector, or general"""
             return 'general'
 
     
+    def _failed(self, message: str, error: Optional[Exception] = None) -> str:
+        """Record that this request failed (see respond) and return the message for the customer"""
+        self._request.error = str(error) if error is not None else message
+        return message
+
     def handle_sql_query(self, question: str) -> str:
         if not self.sql_chain:
-            return "I'm sorry, I cannot access the database right now. Please try again later or contact support."
+            return self._failed("I'm sorry, I cannot access the database right now. Please try again later or contact support.")
         
         try:
             print("Querying database...")
             result = self.sql_chain.invoke({"query": question})
             return result["result"]     
         except Exception as e:
-            return f"I encountered an issue accessing the database: {str(e)}"
+            return self._failed(f"I encountered an issue accessing the database: {str(e)}", e)
 
     
-    def handle_vector_query(self, question: str) -> str:
-        """Handle vector search queries with product-style recommendations"""
+    def retrieve_products(self, question: str):
+        """Category detection and product retrieval. Returns (docs, category or None)."""
+        # --- Category detection ---
+        category_map = {
+            "phone": "smartphones",
+            "phones": "smartphones",
+            "smartphone": "smartphones",
+            "tv": "tv",
+            "tvs": "tv",
+            "television": "tv",
+            "laptop": "laptops",
+            "laptops": "laptops",
+            "watch": "watches",
+            "watches": "watches",
+            "printer": "printers",
+            "printers": "printers",
+            "monitor": "monitors",
+            "monitors": "monitors",
+        }
+        
+        category, category_filter = None, None
+        for keyword, cat in category_map.items():
+            if keyword in question.lower():
+                category = cat
+                category_filter = Filter(
+                    must=[FieldCondition(
+                        key="metadata.category",
+                        match=MatchValue(value=cat)
+                    )]
+                )
+                print(f"Applying category filter: {cat}")
+                break
+
+        wants_popular = any(kw in question.lower() for kw in POPULARITY_KEYWORDS)
+
+        # --- Run retrieval ---
+        if wants_popular:
+            docs = self._search_popular_products(question, category_filter)
+        elif category_filter:
+            docs = self.vectorstore_retriever.vectorstore.similarity_search(
+                question, k=5, filter=category_filter
+            )
+        else:
+            docs = self.vectorstore_retriever.invoke(question)
+        return docs, category
+
+    def handle_vector_query(self, question: str, retrieved=None) -> str:
+        """
+        Handle vector search queries with product-style recommendations.
+        retrieved is a (docs, category) result of retrieve_products() run ahead of time.
+        """
         if not self.vector_chain or not self.vectorstore_retriever:
-            return "I'm sorry, I cannot search the knowledge base right now. Please try again later."
+            return self._failed("I'm sorry, I cannot search the knowledge base right now. Please try again later.")
         
         try:
-            print("🔍 Searching knowledge base...")
-
-            # --- Category detection ---
-            category_map = {
-                "phone": "smartphones",
-                "phones": "smartphones",
-                "smartphone": "smartphones",
-                "tv": "tv",
-                "tvs": "tv",
-                "television": "tv",
-                "laptop": "laptops",
-                "laptops": "laptops",
-                "watch": "watches",
-                "watches": "watches",
-                "printer": "printers",
-                "printers": "printers",
-                "monitor": "monitors",
-                "monitors": "monitors",
-            }
-            
-            category_filter = None
-            for keyword, cat in category_map.items():
-                if keyword in question.lower():
-                    category_filter = Filter(
-                        must=[FieldCondition(
-                            key="metadata.category",
-                            match=MatchValue(value=cat)
-                        )]
-                    )
-                    print(f"Applying category filter: {cat}")
-                    break
-
-            # --- Run retrieval ---
-            if category_filter:
-                docs = self.vectorstore_retriever.vectorstore.similarity_search(
-                    question, k=5, filter=category_filter
-                )
-            else:
-                docs = self.vectorstore_retriever.invoke(question)
+            if retrieved is None:
+                print("🔍 Searching knowledge base...")
+                retrieved = self.retrieve_products(question)
+            docs, category = retrieved
 
             if not docs:
-                return f"I couldn't find any products{f' in category {cat}' if category_filter else ''}."
-
-            # Build richer snippets that include metadata
-            product_snippets = "\n".join([
-                f"- {doc.page_content} "
-                f"(Category: {doc.metadata.get('category', 'N/A')}, "
-                f"Price: {doc.metadata.get('price', 'N/A')}, "
-                f"Stock: {doc.metadata.get('stock_quantity', 'N/A')})"
-                for doc in docs[:5]
-            ])
+                return f"I couldn't find any products{f' in category {category}' if category else ''}."
+
+            product_snippets = self._product_snippets(docs)
             
             prompt = f"""
     You are a product recommendation assistant.
@@ -354,19 +450,75 @@ Respond with only: sql, vector, or general"""
             return result
         
         except Exception as e:
-            return f"I encountered an issue searching our knowledge base: {str(e)}"
+            return self._failed(f"I encountered an issue searching our knowledge base: {str(e)}", e)
+
+
+    def _product_snippets(self, docs) -> str:
+        """Build richer snippets that include metadata"""
+        return "\n".join([
+            f"- {doc.page_content} "
+            f"(Category: {doc.metadata.get('category', 'N/A')}, "
+            f"Price: {doc.metadata.get('price', 'N/A')}, "
+            f"Stock: {doc.metadata.get('stock_quantity', 'N/A')}, "
+            f"Units sold: {doc.metadata.get('units_sold', 'N/A')})"
+            for doc in docs[:5]
+        ])
+
+    def _search_popular_products(self, question: str, category_filter: Optional[Filter] = None):
+        """Single similarity search over products, re-ranked by sales payload"""
+        conditions = [FieldCondition(key="metadata.table", match=MatchValue(value="products"))]
+        if category_filter:
+            conditions.extend(category_filter.must)
 
+        results = self.vectorstore_retriever.vectorstore.similarity_search_with_score(
+            question, k=POPULARITY_CANDIDATES, filter=Filter(must=conditions)
+        )
+        if not results:
+            return []
+
+        # blend similarity with log-scaled units sold, normalised over the candidates
+        max_sold = max(doc.metadata.get("units_sold") or 0 for doc, _ in results)
+        scale = math.log1p(max_sold) or 1.0
+
+        def rank(item):
+            doc, score = item
+            sold = doc.metadata.get("units_sold") or 0
+            return score + POPULARITY_WEIGHT * math.log1p(sold) / scale
+
+        ranked = sorted(results, key=rank, reverse=True)
+        print(f"Ranked {len(ranked)} candidates by popularity")
+        return [doc for doc, _ in ranked[:5]]
+    
+    def _standalone_question(self, question: str, history: str) -> str:
+        """Rewrite a follow-up so routing and retrieval work without the history"""
+        prompt = f"""Conversation so far:
+{history}
+
+Rewrite the customer's latest message as a standalone question that keeps every
+order number, product and constraint it refers to. If it already stands alone,
+return it unchanged. Respond with only the question.
+
+Latest message: {question}"""
+        try:
+            rewritten = self.llms["memory"].invoke(prompt).content.strip()
+            print(f"Follow-up rewritten as: {rewritten}")
+            return rewritten or question
+        except Exception as e:
+            print(f"Follow-up rewrite failed: {e}")
+            return question
     
-    def handle_general_query(self, question: str) -> str:
+    def handle_general_query(self, question: str, history: str = "") -> str:
         """Handle general queries with LLM"""
         try:
             print("Processing general inquiry...")
             general_prompt = PromptTemplate(
-                input_variables=["question"],
+                input_variables=["question", "history"],
                 template="""You are a helpful customer support assistant. 
 Answer this question professionally and courteously. If you cannot provide 
 specific information, guide the customer on how to get help.
 
+{history}
+
 Question: {question}
 
 Answer:"""
@@ -376,35 +528,195 @@ Answer:"""
             try:
                 # Create general chain
                 from langchain.chains import LLMChain
-                general_chain = LLMChain(llm=self.llm, prompt=general_prompt)
+                general_chain = LLMChain(llm=self.llms["general"], prompt=general_prompt)
 
                 # Handle both modern and legacy approaches  
                 if hasattr(general_chain, 'invoke'):
-                    result = general_chain.invoke({"question": question})
+                    result = general_chain.invoke({"question": question, "history": history})
                     return result["text"] if isinstance(result, dict) and "text" in result else str(result)
                 else:
-                    return general_chain.run(question=question)
+                    return general_chain.run(question=question, history=history)
             except Exception as chain_error:
-                return f"I apologize, but I'm experiencing technical difficulties: {str(chain_error)}"
+                return self._failed(f"I apologize, but I'm experiencing technical difficulties: {str(chain_error)}", chain_error)
             
         except Exception as e:
-            return "I apologize, but I'm experiencing technical difficulties. Please contact our support team directly."
+            return self._failed("I apologize, but I'm experiencing technical difficulties. Please contact our support team directly.", e)
     
-    def ask(self, question: str) -> str:
-        """Main method to handle customer questions"""
+    def ask(self, question: str, session_id: Optional[str] = None) -> str:
+        """Main method to handle customer questions. Pass a session_id for multi-turn chats."""
+        return self.respond(question, session_id)[0]
+
+    def respond(self, question: str, session_id: Optional[str] = None):
+        """
+        Like ask(), but returns (answer, route, error); route is the tool name in
+        tools mode. error is None when the question was answered, otherwise what
+        went wrong (the answer is then the apology the customer sees).
+        """
         print(f"\n❓ Question: {question}")
+        self._request.error = None
+
+        history = self.memory.history(session_id) if session_id else ""
+        if self.tool_llm:
+            answer, route = self.ask_with_tools(question, history)
+        else:
+            answer, route = self._ask_routed(question, history)
+
+        if session_id:
+            self.memory.add_turn(session_id, question, answer)
+        return answer, route, self._request.error
+
+    def _ask_routed(self, question: str, history: str = ""):
+        """Route first, then let the chosen handler answer. Returns (answer, route)."""
+        standalone = self._standalone_question(question, history) if history else question
         
+        # product retrieval doesn't depend on the route, so it can run while routing
+        speculation = None
+        if self.speculator and self.vector_chain and self.vectorstore_retriever:
+            speculation = self.speculator.start(self.retrieve_products, standalone)
+
         # Route the question
-        route = self.route_question(question)
+        route = self.route_question(standalone)
         print(f"🎯 Route: {route}")
+
+        retrieved = None
+        if speculation:
+            retrieved = self.speculator.finish(speculation, use=(route == 'vector'))
         
         # Handle based on route
         if route == 'sql':
-            return self.handle_sql_query(question)
+            return self.handle_sql_query(standalone), route
         elif route == 'vector':
-            return self.handle_vector_query(question)
+            return self.handle_vector_query(standalone, retrieved), route
         else:
-            return self.handle_general_query(question)
+            return self.handle_general_query(
+                standalone, f"Conversation so far:\n{history}" if history else ""
+            ), route
+
+    def ask_with_tools(self, question: str, history: str = ""):
+        """
+        One tool-calling LLM call picks sql_lookup, product_search or direct_answer
+        with its arguments; the tool runs locally and at most one more call turns
+        its result into the answer. Returns (answer, tool name).
+        """
+        messages = [SystemMessage(content=TOOLS_SYSTEM_PROMPT)]
+        if self.sql_schema:
+            messages.append(SystemMessage(content=self.sql_schema))
+        if history:
+            messages.append(SystemMessage(content=f"Conversation so far:\n{history}"))
+        messages.append(HumanMessage(content=question))
+
+        try:
+            response = self.tool_llm.invoke(messages)
+        except Exception as e:
+            print(f"Tool call failed, routing instead: {e}")
+            return self._ask_routed(question, history)
+        if not response.tool_calls:
+            return response.content, "direct_answer"
+
+        call = response.tool_calls[0]
+        print(f"🛠️ Tool: {call['name']} {call['args']}")
+        try:
+            args = TOOL_ARGS[call["name"]](**call["args"])
+        except (KeyError, ValidationError) as e:
+            print(f"Unusable tool call, routing instead: {e}")
+            return self._ask_routed(question, history)
+
+        if call["name"] == "direct_answer":
+            return args.answer, call["name"]
+        if call["name"] == "sql_lookup":
+            result, final = self._tool_sql_lookup(args)
+            if final:
+                return result, call["name"]
+        else:
+            result = self._tool_product_search(args)
+
+        context = f"Conversation so far:\n{history}\n\n" if history else ""
+        prompt = f"""{context}The customer asked: "{question}"
+
+Result of {call['name']}:
+{result}
+
+Answer the customer from this result. Be helpful, concise and friendly. Include product
+names and prices when listing products. If the result doesn't answer the question, say so politely."""
+        try:
+            return self.llms["agent"].invoke(prompt).content, call["name"]
+        except Exception as e:
+            return self._failed(f"I encountered an issue answering your question: {str(e)}", e), call["name"]
+
+    def _tool_sql_lookup(self, args: SqlLookup):
+        """
+        Returns (text, final). Lookups by id run a fixed query, other questions the
+        query the tool call wrote; only without a usable one does the SQL chain run.
+        """
+        if not self.sql_chain:
+            return self._failed("I'm sorry, I cannot access the database right now. Please try again later or contact support."), True
+        db = self.sql_chain.database
+
+        try:
+            if args.order_id is not None or args.order_number:
+                column, value = (
+                    ("order_id", args.order_id) if args.order_id is not None
+                    else ("order_number", args.order_number)
+                )
+                if self.support_views:
+                    query = f"SELECT * FROM order_summary WHERE {column} = :value"
+                else:
+                    query = f"""
+                        SELECT o.order_id, o.order_number, o.user_id, o.order_date, o.status,
+                               o.total_amount, string_agg(oi.quantity || ' x ' || p.name, '; ') AS items
+                        FROM orders o
+                        LEFT JOIN order_items oi ON oi.order_id = o.order_id
+                        LEFT JOIN products p ON p.product_id = oi.product_id
+                        WHERE o.{column} = :value
+                        GROUP BY o.order_id
+                    """
+                rows = db.run(query, include_columns=True, parameters={"value": value})
+                return rows or f"No order found with {column} {value}.", False
+
+            if args.user_id is not None and self.support_views:
+                rows = db.run(
+                    "SELECT * FROM user_order_history WHERE user_id = :value",
+                    include_columns=True, parameters={"value": args.user_id},
+                )
+                return rows or f"No customer found with user_id {args.user_id}.", False
+        except Exception as e:
+            return self._failed(f"I encountered an issue accessing the database: {str(e)}", e), True
+
+        if args.sql and READ_ONLY_SQL.match(args.sql):
+            try:
+                rows = db.run(args.sql.strip().rstrip(";"), include_columns=True)
+                return rows or "No matching rows.", False
+            except Exception as e:
+                print(f"sql_lookup query failed, using the SQL chain: {e}")
+        elif args.sql:
+            print("sql_lookup query is not a single SELECT, using the SQL chain")
+
+        # no usable query in the tool call, have the chain write one
+        return self.handle_sql_query(args.question), True
+
+    def _tool_product_search(self, args: ProductSearch) -> str:
+        if not self.vectorstore_retriever:
+            return self._failed("Product search is unavailable right now.")
+
+        conditions = [FieldCondition(key="metadata.table", match=MatchValue(value="products"))]
+        if args.category:
+            conditions.append(FieldCondition(key="metadata.category", match=MatchValue(value=args.category.value)))
+        if args.min_price is not None or args.max_price is not None:
+            conditions.append(FieldCondition(
+                key="metadata.price", range=Range(gte=args.min_price, lte=args.max_price)
+            ))
+        search_filter = Filter(must=conditions)
+
+        try:
+            if args.popular:
+                docs = self._search_popular_products(args.query, search_filter)
+            else:
+                docs = self.vectorstore_retriever.vectorstore.similarity_search(
+                    args.query, k=5, filter=search_filter
+                )
+        except Exception as e:
+            return self._failed(f"Product search failed: {str(e)}", e)
+        return self._product_snippets(docs) if docs else "No matching products found."
 
 # interactive repl
 def main():
@@ -427,13 +739,19 @@ def main():
                     print("👋 Goodbye!")
                     break
                 
-                answer = agent.ask(question)
+                answer = agent.ask(question, session_id="cli")
                 print(f"💬 Agent: {answer}")
             except KeyboardInterrupt:
                 print("\n👋 Goodbye!")
                 break
             except Exception as e:
                 print(f"Error: {e}")
+
+        print("\nPer-stage latency and cost this session:")
+        stage_stats.report()
+        if agent.speculator:
+            agent.speculator.report()
+        openai_client.report()
     
     except Exception as e:
         print(f"❌ Initialization failed: {e}")
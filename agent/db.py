@@ -1,13 +1,18 @@
-import psycopg2
-
-def get_connection():
-    return psycopg2.connect(
-        dbname="mydatabase2",
-        user="store_user",
-        password="password",
-        host="localhost",
-        port=5432,
-    )
+import psycopg
+
+CONNINFO = dict(
+    dbname="mydatabase2",
+    user="store_user",
+    password="password",
+    host="localhost",
+    port=5432,
+)
+
+def get_connection(autocommit=False):
+    return psycopg.connect(autocommit=autocommit, **CONNINFO)
+
+async def get_async_connection(autocommit=True):
+    return await psycopg.AsyncConnection.connect(autocommit=autocommit, **CONNINFO)
 
 def get_last_sync_time(table_name): ...
 def update_last_sync_time(table_name): ...
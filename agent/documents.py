@@ -0,0 +1,106 @@
+import os
+import uuid
+
+POPULARITY_WINDOW_DAYS = int(os.getenv("POPULARITY_WINDOW_DAYS", "30"))
+
+# columns to skip for embedding text
+SKIP_COLS = {
+    "order_item_id", "order_id", "product_id", "quantity",
+    "order_id", "order_number", "user_id", "order_date",
+    "product_id", "category_checksum", "category_source", "user_id", "created_at",
+    "price", "total_amount", "stock_quantity",  # these go in structured metadata
+    "category",  # metadata too; keeps product vectors free of the LLM label
+}
+
+# Structured fields so it can be is able to be searched and filterable
+SEARCHABLE_FIELDS = ("price", "category", "stock_quantity")
+
+# md5 of the row as Postgres sees it, stored with each point so drift can be
+# detected by comparing hashes instead of re-embedding. Expects the table aliased as t.
+ROW_HASH_SQL = "md5(to_jsonb(t)::text) AS row_hash"
+
+NO_SALES = {
+    "units_sold": 0,
+    "order_count": 0,
+    "recent_units_sold": 0,
+    "sales_velocity": 0.0,
+}
+
+
+def point_id_for(table, pk_value):
+    # Stable unique IDs
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{table}_{pk_value}"))
+
+
+def compute_popularity(cur, lo=None, hi=None, product_ids=None):
+    """
+    Sales aggregates per product, computed in one set-based pass over order_items
+    so product documents can be ranked by popularity without a join at query time.
+    lo/hi restrict the pass to a product_id range [lo, hi), product_ids to a set of ids.
+    """
+    range_clause = ""
+    params = [POPULARITY_WINDOW_DAYS]
+    if lo is not None:
+        range_clause = "AND oi.product_id >= %s AND oi.product_id < %s"
+        params += [lo, hi]
+    elif product_ids is not None:
+        range_clause = "AND oi.product_id = ANY(%s)"
+        params.append(list(product_ids))
+
+    cur.execute(f"""
+        SELECT oi.product_id,
+               SUM(oi.quantity) AS units_sold,
+               COUNT(DISTINCT oi.order_id) AS order_count,
+               COALESCE(SUM(oi.quantity) FILTER (
+                   WHERE o.order_date >= now() - %s * interval '1 day'
+               ), 0) AS recent_units_sold
+        FROM order_items oi
+        JOIN orders o ON o.order_id = oi.order_id
+        WHERE o.status <> 'cancelled' {range_clause}
+        GROUP BY oi.product_id;
+    """, params)
+
+    popularity = {}
+    for product_id, units_sold, order_count, recent_units_sold in cur.fetchall():
+        popularity[product_id] = {
+            "units_sold": int(units_sold),
+            "order_count": int(order_count),
+            "recent_units_sold": int(recent_units_sold),
+            "sales_velocity": round(recent_units_sold / POPULARITY_WINDOW_DAYS, 4),
+        }
+    return popularity
+
+
+def searchable_payload(row_dict):
+    """Structured metadata fields of a row, with numerics stored as numbers"""
+    payload = {field: row_dict.get(field) for field in SEARCHABLE_FIELDS}
+    if payload["price"] is not None:
+        payload["price"] = float(payload["price"])
+    if "row_hash" in row_dict:
+        payload["row_hash"] = row_dict["row_hash"]
+    return payload
+
+
+def build_document(table, pk_col, row_dict, popularity=None):
+    """Returns (text, metadata, point_id) for one row"""
+    pk_value = row_dict[pk_col]
+
+    text_parts = []
+    for col, val in row_dict.items():
+        if val is None or col in SKIP_COLS or col == "row_hash":
+            continue
+        text_parts.append(f"{col}: {val}")
+
+    text = " | ".join(text_parts)
+
+    # Build metadata (structured + fallback info)
+    metadata = {
+        "table": table,
+        "primary_key": pk_value,
+        **searchable_payload(row_dict),    # explicitly stored structured fields
+    }
+
+    if table == "products":
+        metadata.update((popularity or {}).get(pk_value, NO_SALES))
+
+    return text, metadata, point_id_for(table, pk_value)
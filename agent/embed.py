@@ -1,54 +1,56 @@
 import os
-import uuid
+import sys
+import time
+import atexit
 import psycopg2
 from psycopg2 import sql
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
 from langchain_qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance
+from qdrant_client.models import VectorParams, Distance, PayloadSchemaType
+from documents import ROW_HASH_SQL, build_document, compute_popularity
+from token_batching import EMBEDDING_MODEL, MAX_REQUEST_ITEMS, token_batches
+from triggers import TRIGGER_TABLES
+import openai_client
+from openai_client import BATCH, embeddings_model
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 QDRANT_URL = os.getenv("QDRANT_URL")
 COLLECTION_NAME = "postgres_v2"
-BATCH_SIZE = 1000 
-
-# pg connect
-conn = psycopg2.connect(DATABASE_URL)
-cur = conn.cursor()
-
-# see all user tables
-cur.execute("""
-    SELECT table_name 
-    FROM information_schema.tables 
-    WHERE table_schema = 'public' AND table_type='BASE TABLE';
-""")
-tables = [row[0] for row in cur.fetchall()]
-print(f"Found tables: {tables}")
-
-# Setup Qdrant client and embeddings
-qdrant = QdrantClient(url=QDRANT_URL)
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-
-if not qdrant.collection_exists(COLLECTION_NAME):
-    qdrant.create_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=VectorParams(size=1536, distance=Distance.COSINE)
-    )
-    print(f"Created collection {COLLECTION_NAME}")
-else:
-    print(f"ℹCollection {COLLECTION_NAME} already exists, skipping creation.")
-
-vectorstore = QdrantVectorStore(
-    client=qdrant,
-    collection_name=COLLECTION_NAME,
-    embedding=embeddings,
-)
-
-for table in tables:
-    # Find primary key column
+BATCH_SIZE = 1000  # rows fetched per query; embedding requests are packed by tokens
+
+# sharding of the bulk build: each shard is a primary-key range of one table
+SHARD_SIZE = int(os.getenv("EMBED_SHARD_SIZE", "10000"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", str(os.cpu_count() or 1)))
+SHARD_RETRIES = int(os.getenv("EMBED_SHARD_RETRIES", "3"))
+
+# payload fields with a qdrant index, so they can be filtered / ranked on
+PAYLOAD_INDEXES = {
+    "metadata.table": PayloadSchemaType.KEYWORD,
+    "metadata.category": PayloadSchemaType.KEYWORD,
+    "metadata.price": PayloadSchemaType.FLOAT,
+    "metadata.units_sold": PayloadSchemaType.INTEGER,
+    "metadata.order_count": PayloadSchemaType.INTEGER,
+    "metadata.sales_velocity": PayloadSchemaType.FLOAT,
+}
+
+
+def get_tables(cur):
+    # the store tables sync.py keeps current; the schema also holds internal
+    # ones (outbox, leases, caches, summaries) that must not become "knowledge"
+    cur.execute("""
+        SELECT table_name
+        FROM information_schema.tables
+        WHERE table_schema = 'public' AND table_type='BASE TABLE'
+          AND table_name = ANY(%s);
+    """, (list(TRIGGER_TABLES),))
+    return [row[0] for row in cur.fetchall()]
+
+
+def get_primary_key(cur, table):
     cur.execute(sql.SQL("""
         SELECT a.attname
         FROM pg_index i
@@ -58,80 +60,197 @@ for table in tables:
         AND i.indisprimary;
     """), [table])
     pk_row = cur.fetchone()
-    if not pk_row:
-        print(f"Skipping table {table}: no primary key found.")
-        continue
+    return pk_row[0] if pk_row else None
+
 
-    pk_col = pk_row[0]
-    print(f"Processing {table}, primary key = {pk_col}")
+def ensure_collection(qdrant):
+    if not qdrant.collection_exists(COLLECTION_NAME):
+        qdrant.create_collection(
+            collection_name=COLLECTION_NAME,
+            vectors_config=VectorParams(size=1536, distance=Distance.COSINE)
+        )
+        print(f"Created collection {COLLECTION_NAME}")
+    else:
+        print(f"ℹCollection {COLLECTION_NAME} already exists, skipping creation.")
 
-    # Count rows
-    cur.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(table)))
-    row = cur.fetchone()
-    total_rows = row[0] if row is not None else 0
+    for field_name, field_schema in PAYLOAD_INDEXES.items():
+        qdrant.create_payload_index(
+            collection_name=COLLECTION_NAME,
+            field_name=field_name,
+            field_schema=field_schema,
+        )
 
 
-    for offset in range(0, total_rows, BATCH_SIZE):
+def plan_shards(cur, tables):
+    """Split every table into primary-key ranges of SHARD_SIZE"""
+    shards = []
+    for table in tables:
+        pk_col = get_primary_key(cur, table)
+        if not pk_col:
+            print(f"Skipping table {table}: no primary key found.")
+            continue
+
         cur.execute(
-            sql.SQL("SELECT * FROM {} ORDER BY {} LIMIT %s OFFSET %s")
-            .format(sql.Identifier(table), sql.Identifier(pk_col)),
-            (BATCH_SIZE, offset)
+            sql.SQL("SELECT MIN({pk}), MAX({pk}) FROM {t}")
+            .format(pk=sql.Identifier(pk_col), t=sql.Identifier(table))
         )
-        rows = cur.fetchall()
-        if not rows or cur.description is None:
+        lo, hi = cur.fetchone()
+        if lo is None:
+            print(f"Skipping table {table}: empty.")
+            continue
+
+        if not isinstance(lo, int):
+            # non-integer keys can't be range-split, embed as one shard
+            shards.append((table, pk_col, None, None))
             continue
 
-        colnames = [desc[0] for desc in cur.description]
+        for start in range(lo, hi + 1, SHARD_SIZE):
+            shards.append((table, pk_col, start, start + SHARD_SIZE))
+        print(f"Planned {table}, primary key = {pk_col}, ids {lo}-{hi}")
+    return shards
+
+
+# --- per-process worker state ---
+_worker = {}
+
+
+def _init_worker():
+    """Each worker process gets its own DB connection and Qdrant client"""
+    conn = psycopg2.connect(DATABASE_URL)
+    qdrant = QdrantClient(url=QDRANT_URL)
+    # the workers run side by side, each gets an even share of any per-process cap
+    openai_client.set_share(1 / EMBED_WORKERS)
+    _worker["conn"] = conn
+    _worker["vectorstore"] = QdrantVectorStore(
+        client=qdrant,
+        collection_name=COLLECTION_NAME,
+        # one embedding request per packed batch, token_batches enforces the limits
+        embedding=embeddings_model(BATCH, model=EMBEDDING_MODEL, chunk_size=MAX_REQUEST_ITEMS),
+    )
+    atexit.register(conn.close)
+
+
+def embed_shard(shard):
+    """Embed and upsert all rows of one primary-key range; returns (rows, tokens)"""
+    table, pk_col, lo, hi = shard
+    conn = _worker["conn"]
+    vectorstore = _worker["vectorstore"]
+
+    done = 0
+    tokens = 0
+    try:
+        with conn.cursor() as cur:
+            popularity = {}
+            if table == "products":
+                popularity = compute_popularity(cur, lo, hi)
+
+            last_pk = None
+            while True:
+                # keyset pagination inside the shard range
+                conditions, params = [], []
+                if lo is not None:
+                    conditions.append(sql.SQL("{} >= %s AND {} < %s").format(
+                        sql.Identifier(pk_col), sql.Identifier(pk_col)))
+                    params += [lo, hi]
+                if last_pk is not None:
+                    conditions.append(sql.SQL("{} > %s").format(sql.Identifier(pk_col)))
+                    params.append(last_pk)
+                where = sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
 
-        texts, metadatas, ids = [], [], []
+                cur.execute(
+                    sql.SQL("SELECT t.*, {} FROM {} t {} ORDER BY {} LIMIT %s")
+                    .format(sql.SQL(ROW_HASH_SQL), sql.Identifier(table), where, sql.Identifier(pk_col)),
+                    params + [BATCH_SIZE]
+                )
+                rows = cur.fetchall()
+                if not rows or cur.description is None:
+                    break
 
-        for row in rows:
-            row_dict = dict(zip(colnames, row))
-            pk_value = row_dict[pk_col]
+                colnames = [desc[0] for desc in cur.description]
+                docs = [
+                    build_document(table, pk_col, dict(zip(colnames, row)), popularity)
+                    for row in rows
+                ]
 
-            # Structured fields so it can be is able to be searched and filterable
-            searchable_fields = {
-                "price": row_dict.get("price"),
-                "category": row_dict.get("category"),
-                "stock_quantity": row_dict.get("stock_quantity"),
-            }
+                # Upsert into Qdrant, one embedding request per token-packed batch
+                for texts, metadatas, ids, batch_tokens in token_batches(docs):
+                    vectorstore.add_texts(
+                        texts=texts, metadatas=metadatas, ids=ids, batch_size=len(texts)
+                    )
+                    tokens += batch_tokens
+                done += len(rows)
+                last_pk = rows[-1][colnames.index(pk_col)]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return done, tokens
 
-            # columns to skip for embedding text
-            SKIP_COLS = {
-                "order_item_id", "order_id", "product_id", "quantity",
-                "order_id", "order_number", "user_id", "order_date",
-                "product_id", "category_checksum", "user_id", "created_at",
-                "price", "total_amount", "stock_quantity"  # these go in structured metadata
-            }
 
-            text_parts = []
-            for col, val in row_dict.items():
-                if val is None or col in SKIP_COLS:
+def run_shards(shards):
+    """Distribute shards over a process pool, retrying failed shards"""
+    attempts = {shard: 0 for shard in shards}
+    failed = []
+    total_rows = 0
+    total_tokens = 0
+    completed = 0
+    started = time.monotonic()
+
+    with ProcessPoolExecutor(max_workers=EMBED_WORKERS, initializer=_init_worker) as pool:
+        pending = {pool.submit(embed_shard, shard): shard for shard in shards}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard = pending.pop(future)
+                table, _, lo, hi = shard
+                label = f"{table} [{lo}, {hi})" if lo is not None else table
+                attempts[shard] += 1
+                try:
+                    rows, tokens = future.result()
+                except Exception as e:
+                    if attempts[shard] < SHARD_RETRIES:
+                        print(f"Shard {label} failed (attempt {attempts[shard]}): {e}, retrying")
+                        pending[pool.submit(embed_shard, shard)] = shard
+                    else:
+                        print(f"Shard {label} failed after {attempts[shard]} attempts: {e}")
+                        failed.append(shard)
                     continue
-                text_parts.append(f"{col}: {val}")
 
-            text = " | ".join(text_parts)
+                completed += 1
+                total_rows += rows
+                total_tokens += tokens
+                rate = total_tokens / max(time.monotonic() - started, 1e-6)
+                print(f"[{completed}/{len(shards)}] Inserted {rows} rows ({tokens} tokens) "
+                      f"of {label}, {rate:,.0f} tokens/s overall")
+    return total_rows, total_tokens, failed
+
+
+def main():
+    # pg connect
+    conn = psycopg2.connect(DATABASE_URL)
+    cur = conn.cursor()
 
-            # Build metadata (structured + fallback info)
-            metadata = {
-                "table": table,
-                "primary_key": pk_value,
-                **searchable_fields,    # explicitly stored structured fields
-            }
+    tables = get_tables(cur)
+    print(f"Found tables: {tables}")
 
+    # Setup Qdrant collection once before fanning out
+    ensure_collection(QdrantClient(url=QDRANT_URL))
 
-            # Stable unique IDs
-            point_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{table}_{pk_value}"))
+    shards = plan_shards(cur, tables)
+    cur.close()
+    conn.close()
 
-            texts.append(text)
-            metadatas.append(metadata)
-            ids.append(point_id)
+    print(f"Embedding {len(shards)} shards with {EMBED_WORKERS} workers")
+    started = time.monotonic()
+    total_rows, total_tokens, failed = run_shards(shards)
+    elapsed = time.monotonic() - started
 
-        # Upsert batch into Qdrant (hybrid)
-        vectorstore.add_texts(texts=texts, metadatas=metadatas, ids=ids)
+    if failed:
+        print(f"{len(failed)} shards failed: {failed}")
+        sys.exit(1)
+    print(f"All tables processed ({total_rows} rows, {total_tokens} tokens, "
+          f"{total_tokens / max(elapsed, 1e-6):,.0f} tokens/s).")
 
-        print(f"Inserted batch {offset}-{offset+len(rows)} of {table}")
 
-cur.close()
-conn.close()
-print("All tables processed.")
+if __name__ == "__main__":
+    main()
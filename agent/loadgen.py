@@ -0,0 +1,222 @@
+import os
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import psycopg2
+from faker import Faker
+from seed import (
+    DATABASE_URL, build_master_catalog, copy_rows, create_indexes, create_tables, expand_products,
+    require_database_url, reset_sequence,
+)
+
+# Load-test dataset generator. Like seed.py, but streams rows partition by
+# partition from worker processes, so 10-100M order items fit in flat memory.
+# Every partition has its own RNG seeded from (LOADGEN_SEED, partition), so the
+# data is the same whatever the worker count; pin LOADGEN_END too and reruns
+# are identical.
+LOADGEN_USERS = int(os.getenv("LOADGEN_USERS", "1000000"))
+LOADGEN_ORDERS = int(os.getenv("LOADGEN_ORDERS", "10000000"))
+LOADGEN_VARIANTS = int(os.getenv("LOADGEN_VARIANTS", "20"))
+LOADGEN_WORKERS = int(os.getenv("LOADGEN_WORKERS", str(os.cpu_count() or 4)))
+LOADGEN_SEED = int(os.getenv("LOADGEN_SEED", "42"))
+LOADGEN_PARTITION = int(os.getenv("LOADGEN_PARTITION", "250000"))  # users/orders per partition
+LOADGEN_DAYS = int(os.getenv("LOADGEN_DAYS", "1095"))  # order history span
+LOADGEN_END = os.getenv("LOADGEN_END")  # YYYY-MM-DD, defaults to today
+
+# a few customers and best-sellers take most orders: P(rank r) ~ (r + 1) ** -skew
+USER_SKEW = float(os.getenv("LOADGEN_USER_SKEW", "1.1"))
+PRODUCT_SKEW = float(os.getenv("LOADGEN_PRODUCT_SKEW", "1.3"))
+
+# order_item_id = (order_id - 1) * MAX_ITEMS + position, so partitions never
+# need to agree on item ids (ids are sparse, ~3 of every 5 are used)
+MAX_ITEMS = 5
+
+# status mix by order age in days: recent orders are still open, old ones settled
+STATUS_BY_AGE = (
+    (3, ("pending", "shipped", "cancelled"), (0.60, 0.35, 0.05)),
+    (14, ("pending", "shipped", "delivered", "cancelled"), (0.10, 0.50, 0.35, 0.05)),
+    (math.inf, ("delivered", "cancelled"), (0.95, 0.05)),
+)
+
+
+def power_law_ranks(rng, n, size, skew):
+    """Ranks in [0, n) drawn by inverting a continuous power law on [1, n + 1)"""
+    u = rng.random(size)
+    if skew == 1.0:
+        x = np.power(n + 1.0, u)
+    else:
+        e = 1.0 - skew
+        x = np.power(1.0 + u * (np.power(n + 1.0, e) - 1.0), 1.0 / e)
+    return np.minimum(x.astype(np.int64) - 1, n - 1)
+
+
+def coprime_step(n):
+    step = 2654435761 % n or 1
+    while math.gcd(step, n) != 1:
+        step += 1
+    return step
+
+
+def scatter(ranks, n):
+    """Maps popularity ranks onto ids 1..n (a bijection), so heavy hitters aren't all low ids"""
+    return (ranks * coprime_step(n)) % n + 1
+
+
+def pick_status(age_days, u):
+    for max_age, statuses, weights in STATUS_BY_AGE:
+        if age_days < max_age:
+            break
+    for status, weight in zip(statuses, weights):
+        if u < weight:
+            return status
+        u -= weight
+    return statuses[-1]
+
+
+def partitions(total):
+    """[lo, hi) id ranges of LOADGEN_PARTITION rows, ids starting at 1"""
+    return [
+        (part, lo, min(lo + LOADGEN_PARTITION, total + 1))
+        for part, lo in enumerate(range(1, total + 1, LOADGEN_PARTITION))
+    ]
+
+
+# per-process state, set up by _init_worker
+_conn = None
+_config = None
+
+
+def _init_worker(config):
+    global _conn, _config
+    _conn = psycopg2.connect(DATABASE_URL)
+    _config = config
+
+
+def load_users(part, lo, hi):
+    fake = Faker()
+    fake.seed_instance(LOADGEN_SEED * 1_000_003 + part)
+    with _conn.cursor() as cur:
+        count = copy_rows(cur, "users", ("user_id", "name", "address"), (
+            (user_id, fake.name(), fake.address().replace("\n", ", "))
+            for user_id in range(lo, hi)
+        ))
+    _conn.commit()
+    return count
+
+
+def load_orders(part, lo, hi):
+    num_users = _config["num_users"]
+    prices = _config["prices"]
+    end = _config["end"]
+
+    rng = np.random.default_rng([LOADGEN_SEED, 1, part])
+    size = hi - lo
+    user_ids = scatter(power_law_ranks(rng, num_users, size, USER_SKEW), num_users)
+    # more orders recently: age density falls off linearly over the span
+    ages = LOADGEN_DAYS * (1.0 - np.sqrt(rng.random(size)))
+    status_u = rng.random(size)
+    item_counts = rng.integers(1, MAX_ITEMS + 1, size)
+    total_items = int(item_counts.sum())
+    product_ids = scatter(power_law_ranks(rng, len(prices), total_items, PRODUCT_SKEW), len(prices))
+    quantities = rng.integers(1, 4, total_items)
+
+    orders, items = [], []
+    offset = 0
+    for i in range(size):
+        order_id = lo + i
+        total = 0.0
+        seen = set()
+        for position in range(item_counts[i]):
+            pid = int(product_ids[offset + position])
+            if pid in seen:
+                continue
+            seen.add(pid)
+            qty = int(quantities[offset + position])
+            price = prices[pid - 1]
+            total += price * qty
+            items.append(((order_id - 1) * MAX_ITEMS + position + 1, order_id, pid, qty, price))
+        offset += item_counts[i]
+
+        age = float(ages[i])
+        orders.append((
+            order_id, f"LG-{order_id:010d}", int(user_ids[i]), end - timedelta(days=age),
+            pick_status(age, float(status_u[i])), round(total, 2),
+        ))
+
+    with _conn.cursor() as cur:
+        copy_rows(cur, "orders",
+                  ("order_id", "order_number", "user_id", "order_date", "status", "total_amount"), orders)
+        copy_rows(cur, "order_items",
+                  ("order_item_id", "order_id", "product_id", "quantity", "price"), items)
+    _conn.commit()
+    return len(items)
+
+
+def run_partitions(pool, fn, parts, label):
+    started = time.monotonic()
+    done_parts, rows = 0, 0
+    futures = [pool.submit(fn, part, lo, hi) for part, lo, hi in parts]
+    for future in as_completed(futures):
+        rows += future.result()
+        done_parts += 1
+        elapsed = time.monotonic() - started
+        print(f"  {label}: {done_parts}/{len(parts)} partitions, {rows} rows, {rows / elapsed:.0f} rows/s")
+    return rows
+
+
+def main():
+    if LOADGEN_END:
+        end = datetime.strptime(LOADGEN_END, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    else:
+        end = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    print(f"[{datetime.utcnow().isoformat()}] Connecting to PostgreSQL...")
+    conn = psycopg2.connect(require_database_url())
+    try:
+        print("Recreating tables...")
+        create_tables(conn, drop_existing=True)
+
+        # the catalog is small, generate it here so every worker sees the same prices
+        random.seed(LOADGEN_SEED)
+        product_list = expand_products(build_master_catalog(), multiplier=LOADGEN_VARIANTS)
+        with conn.cursor() as cur:
+            copy_rows(cur, "products", ("product_id", "name", "description", "price", "stock_quantity"), (
+                (pid, p["name"], p["description"], p["price"], p["stock_quantity"])
+                for pid, p in enumerate(product_list, start=1)
+            ))
+        conn.commit()
+        print(f"Loaded {len(product_list)} products")
+
+        config = {
+            "num_users": LOADGEN_USERS,
+            "prices": [p["price"] for p in product_list],
+            "end": end,
+        }
+        started = time.monotonic()
+        with ProcessPoolExecutor(
+            max_workers=LOADGEN_WORKERS, initializer=_init_worker, initargs=(config,)
+        ) as pool:
+            users = run_partitions(pool, load_users, partitions(LOADGEN_USERS), "users")
+            items = run_partitions(pool, load_orders, partitions(LOADGEN_ORDERS), "orders")
+
+        with conn.cursor() as cur:
+            for table, pk in (("users", "user_id"), ("products", "product_id"),
+                              ("orders", "order_id"), ("order_items", "order_item_id")):
+                reset_sequence(cur, table, pk)
+            conn.commit()
+        print("Creating indexes...")
+        create_indexes(conn)
+
+        print(
+            f"Done: {users} users, {LOADGEN_ORDERS} orders, {items} order items "
+            f"in {time.monotonic() - started:.0f}s"
+        )
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Offline runs never reach OpenAI, but qdrant_setup (imported by the agent)
+# builds OpenAIEmbeddings at import time, which wants a key to exist.
+os.environ.setdefault("OPENAI_API_KEY", "sk-offline-load-test")
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, VectorParams
+from documents import build_document
+from model_tiers import STAGE_DEFAULTS
+from seed import build_master_catalog, expand_products
+
+# Load test for CustomerSupportAgent. Replays a question corpus at a fixed
+# arrival rate, either in-process against local stand-ins (fake chat model
+# with simulated latency, deterministic embeddings, in-memory Qdrant and an
+# optional test Postgres) or against an HTTP endpoint, and reports throughput,
+# latency percentiles and errors per route. Latency is measured from each
+# request's scheduled send time, so a backed-up agent shows up in the tail.
+
+DEFAULT_CORPUS = [
+    "What is the status of order 28?",
+    "What did I order in order 1500?",
+    "How many orders does user 42 have?",
+    "Tell me about the watches you sell",
+    "Can you recommend some phones i can buy that you sell",
+    "Show me laptops under $1000",
+    "What are your best selling TVs?",
+    "What are your return policies?",
+    "How do I track my shipment?",
+    "Hi there!",
+]
+
+SQL_WORDS = ("order", "status", "account", "user", "shipment", "track")
+PRODUCT_WORDS = ("product", "recommend", "phone", "laptop", "watch", "tv", "sell", "cheap", "camera")
+
+
+def guess_route(question):
+    q = question.lower()
+    if re.search(r"\d", q) and any(word in q for word in SQL_WORDS):
+        return "sql"
+    if any(word in q for word in PRODUCT_WORDS):
+        return "vector"
+    return "general"
+
+
+def last_match(pattern, text, default=""):
+    matches = re.findall(pattern, text)
+    return matches[-1].strip() if matches else default
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Stand-in for ChatOpenAI: sleeps for a normally distributed latency, then
+    gives a canned reply shaped like what each agent stage expects (a route,
+    a SQL query, a tool call, an answer).
+    """
+
+    latency: float = 0.5
+    jitter: float = 0.15
+    tools_bound: bool = False
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tools_bound": True})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        text = "\n".join(str(m.content) for m in messages)
+        if self.tools_bound:
+            message = self._tool_call(str(messages[-1].content))
+        else:
+            message = AIMessage(content=self._reply(text))
+        usage = {"prompt_tokens": len(text) // 4, "completion_tokens": len(str(message.content)) // 4 + 10}
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"token_usage": usage, "model_name": "fake"},
+        )
+
+    def _reply(self, text):
+        if "customer support router" in text:
+            return guess_route(last_match(r"Question: (.*)", text))
+        stripped = text.rstrip()
+        if stripped.endswith("SQLQuery:"):
+            number = last_match(r"(\d+)", last_match(r"Question: (.*)", text), "")
+            return f"SELECT * FROM orders WHERE order_id = {number}" if number else "SELECT count(*) FROM orders"
+        if "Rewrite the customer's latest message" in text:
+            return last_match(r"Latest message: (.*)", text)
+        if "Summarize this customer support conversation" in text:
+            return "The customer asked about their orders and some products."
+        return "Thanks for reaching out! Here is what I found for you."
+
+    def _tool_call(self, question):
+        route = guess_route(question)
+        number = last_match(r"(\d+)", question, "")
+        if route == "sql":
+            name, args = "sql_lookup", {"question": question, "order_id": int(number) if number else None}
+        elif route == "vector":
+            name, args = "product_search", {"query": question}
+        else:
+            name, args = "direct_answer", {"answer": "Thanks for reaching out! How can I help?"}
+        return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": "call_0"}])
+
+
+def local_vectorstore(dim=1536, variants=1):
+    """In-memory Qdrant with the seed catalog, embedded by a deterministic fake embedder"""
+    client = QdrantClient(":memory:")
+    client.create_collection("loadtest", vectors_config=VectorParams(size=dim, distance=Distance.COSINE))
+    store = QdrantVectorStore(
+        client=client, collection_name="loadtest", embedding=DeterministicFakeEmbedding(size=dim)
+    )
+    docs = [
+        build_document("products", "product_id", {"product_id": i, **product})
+        for i, product in enumerate(expand_products(build_master_catalog(), variants), start=1)
+    ]
+    store.add_texts([d[0] for d in docs], metadatas=[d[1] for d in docs], ids=[d[2] for d in docs])
+    print(f"Loaded {len(docs)} products into in-memory Qdrant")
+    return store
+
+
+def build_agent(args):
+    """CustomerSupportAgent wired to the local stand-ins"""
+    os.environ["AGENT_MODE"] = args.agent_mode
+    os.environ.setdefault("AGENT_CONCURRENCY", str(args.concurrency))
+    # keep load test queries out of the workload the index advisor reads
+    os.environ["SQL_WORKLOAD_LOG"] = args.sql_log
+    from customer_support_agent import CustomerSupportAgent
+
+    if not args.database_url:
+        # no test database: keep the agent away from the one in .env
+        os.environ.pop("DATABASE_URL", None)
+    llms = {
+        stage: FakeChatModel(latency=args.llm_latency, jitter=args.llm_jitter)
+        for stage in STAGE_DEFAULTS
+    }
+    return CustomerSupportAgent(
+        llms=llms, vectorstore=local_vectorstore(), db_url=args.database_url or None
+    )
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def replay(call, questions, rate, total, concurrency, sessions):
+    """
+    Send total requests at rate/s, at most concurrency in flight. call returns
+    (route, ok); raising counts as an error too. Returns (results, seconds).
+    """
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(concurrency)
+    results = []
+    start = loop.time()
+
+    async def one(i):
+        scheduled = start + i / rate
+        await asyncio.sleep(max(0.0, scheduled - loop.time()))
+        session_id = f"load-{i % sessions}" if sessions else None
+        async with limit:
+            try:
+                route, ok = await call(questions[i % len(questions)], session_id)
+            except Exception as e:
+                route, ok = f"error: {type(e).__name__}", False
+        results.append((route, loop.time() - scheduled, ok))
+
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return results, loop.time() - start
+
+
+def report(results, elapsed):
+    by_route = {}
+    for route, latency, ok in results:
+        by_route.setdefault(route, []).append((latency, ok))
+    by_route["all"] = [(latency, ok) for _, latency, ok in results]
+
+    summary = {}
+    print(f"\n{'route':<24} {'n':>6} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'errors':>7}")
+    for route, rows in sorted(by_route.items(), key=lambda item: item[0] == "all"):
+        latencies = [latency for latency, _ in rows]
+        errors = sum(1 for _, ok in rows if not ok)
+        summary[route] = {
+            "requests": len(rows),
+            "throughput": round(len(rows) / elapsed, 2),
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p95": round(percentile(latencies, 0.95), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "error_rate": round(errors / len(rows), 4),
+        }
+        s = summary[route]
+        print(
+            f"{route:<24} {s['requests']:>6} {s['throughput']:>7.2f} {s['p50']:>7.3f} "
+            f"{s['p95']:>7.3f} {s['p99']:>7.3f} {s['error_rate']:>7.2%}"
+        )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the customer support agent")
+    parser.add_argument("--rate", type=float, default=5.0, help="requests per second")
+    parser.add_argument("--requests", type=int, default=200, help="total requests")
+    parser.add_argument("--concurrency", type=int, default=32, help="max requests in flight")
+    parser.add_argument("--corpus", help="file with one question per line (default: built-in set)")
+    parser.add_argument("--sessions", type=int, default=0, help="spread requests over this many chat sessions")
+    parser.add_argument("--url", help="POST questions to this HTTP endpoint instead of running in-process")
+    parser.add_argument("--agent-mode", choices=["route", "tools"], default=os.getenv("AGENT_MODE", "route"))
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="fake LLM mean latency (s)")
+    parser.add_argument("--llm-jitter", type=float, default=0.15, help="fake LLM latency std dev (s)")
+    parser.add_argument("--database-url", default=os.getenv("LOADTEST_DATABASE_URL"),
+                        help="test Postgres for the SQL route (default: SQL route disabled)")
+    parser.add_argument("--sql-log", default="loadtest_sql_workload.jsonl",
+                        help="where the SQL route logs its queries (not sql_workload.jsonl)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="also write the report here")
+    parser.add_argument("--verbose", action="store_true", help="keep the agent's own output")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    questions = DEFAULT_CORPUS
+    if args.corpus:
+        with open(args.corpus) as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    if args.url:
+        import httpx
+        client = httpx.AsyncClient(timeout=60)
+
+        async def call(question, session_id):
+            response = await client.post(args.url, json={"question": question, "session_id": session_id})
+            response.raise_for_status()
+            body = response.json()
+            return body.get("route", "http"), not body.get("error")
+    else:
+        agent = build_agent(args)
+
+        async def call(question, session_id):
+            # the agent answers failures with an apology, error says it was one
+            _, route, error = await asyncio.to_thread(agent.respond, question, session_id)
+            return route, error is None
+
+    async def run():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.concurrency))
+        return await replay(call, questions, args.rate, args.requests, args.concurrency, args.sessions)
+
+    print(f"Sending {args.requests} requests at {args.rate}/s ({args.concurrency} in flight max)...")
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with output:
+        results, elapsed = asyncio.run(run())
+
+    summary = report(results, elapsed)
+    print(f"Done in {elapsed:.1f}s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import numpy as np
+from qdrant_setup import qdrant, COLLECTION_NAME
+from documents import point_id_for
+
+# minimum gap between the best and second best centroid similarity to trust a label
+MIN_MARGIN = float(os.getenv("LOCAL_CLASSIFIER_MIN_MARGIN", "0.05"))
+MIN_EXAMPLES = 5  # categories with fewer labeled products are left to the LLM
+HOLDOUT_EVERY = 5  # every 5th labeled product is held out for the agreement report
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def load_product_vectors(product_ids, chunk_size=256):
+    """Fetch the vectors embed.py/sync.py stored for these products: {product_id: vector}"""
+    vectors = {}
+    for i in range(0, len(product_ids), chunk_size):
+        chunk = product_ids[i:i + chunk_size]
+        points = qdrant.retrieve(
+            collection_name=COLLECTION_NAME,
+            ids=[point_id_for("products", product_id) for product_id in chunk],
+            with_vectors=True,
+            with_payload=["metadata.primary_key"],
+        )
+        for point in points:
+            product_id = point.payload["metadata"]["primary_key"]
+            vectors[product_id] = np.asarray(point.vector, dtype=np.float32)
+    return vectors
+
+
+class CentroidClassifier:
+    """Assigns the category whose mean labeled embedding is closest (cosine)"""
+
+    def fit(self, vectors, labels):
+        """Leaves labels empty (and the classifier unusable) if no category has MIN_EXAMPLES"""
+        labels = np.asarray(labels)
+        self.labels = [
+            label for label in sorted(set(labels)) if (labels == label).sum() >= MIN_EXAMPLES
+        ]
+        self.centroids = None
+        if not self.labels:
+            return self
+        matrix = _normalize(np.stack(vectors))
+        self.centroids = _normalize(
+            np.stack([matrix[labels == label].mean(axis=0) for label in self.labels])
+        )
+        return self
+
+    def predict(self, vectors):
+        """Returns (labels, margins); margin is best minus second best similarity"""
+        sims = _normalize(np.stack(vectors)) @ self.centroids.T
+        order = np.argsort(-sims, axis=1)
+        rows = np.arange(len(sims))
+        best = sims[rows, order[:, 0]]
+        second = sims[rows, order[:, 1]] if len(self.labels) > 1 else np.zeros(len(sims))
+        return [self.labels[i] for i in order[:, 0]], best - second
+
+
+def agreement_report(vectors, labels, min_margin=MIN_MARGIN):
+    """
+    Fit on most of the LLM-labeled products, predict the held out rest and
+    compare: how often the local label matches the LLM, and how much of the
+    catalog clears the confidence margin.
+    """
+    holdout = np.arange(len(labels)) % HOLDOUT_EVERY == 0
+    train_vectors = [v for v, h in zip(vectors, holdout) if not h]
+    train_labels = [l for l, h in zip(labels, holdout) if not h]
+    test_vectors = [v for v, h in zip(vectors, holdout) if h]
+    test_labels = np.asarray([l for l, h in zip(labels, holdout) if h])
+    if not test_vectors or len(set(train_labels)) < 2:
+        print("Not enough labeled products for an agreement report")
+        return None
+
+    classifier = CentroidClassifier().fit(train_vectors, train_labels)
+    if len(classifier.labels) < 2:
+        print(f"Fewer than two categories with {MIN_EXAMPLES} labeled products, no agreement report")
+        return None
+    predicted, margins = classifier.predict(test_vectors)
+    predicted = np.asarray(predicted)
+    confident = margins >= min_margin
+    agree = predicted == test_labels
+
+    report = {
+        "holdout": int(len(test_labels)),
+        "agreement": float(agree.mean()),
+        "coverage": float(confident.mean()),
+        "confident_agreement": float(agree[confident].mean()) if confident.any() else 0.0,
+    }
+    print(
+        f"Local classifier vs LLM on {report['holdout']} held out products: "
+        f"{report['agreement']:.1%} agree overall, "
+        f"{report['coverage']:.1%} above margin {min_margin} "
+        f"with {report['confident_agreement']:.1%} agreement"
+    )
+    for label in sorted(set(test_labels)):
+        mask = test_labels == label
+        print(f"  {label}: {agree[mask].mean():.1%} of {mask.sum()}")
+    return report
+
+
+def classify_locally(classifier, product_ids, min_margin=MIN_MARGIN):
+    """{product_id: category} for products the classifier is confident about"""
+    vectors = load_product_vectors(product_ids)
+    known = [product_id for product_id in product_ids if product_id in vectors]
+    if not known:
+        return {}
+    predicted, margins = classifier.predict([vectors[product_id] for product_id in known])
+    return {
+        product_id: label
+        for product_id, label, margin in zip(known, predicted, margins)
+        if margin >= min_margin
+    }
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import time
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
+from series import Series
+from openai_client import INTERACTIVE, chat_model
+
+# One chat model per agent stage. Routing, SQL writing and the memory
+# rewrites/summaries are short, structured jobs for a small fast model; product
+# and general answers are what the customer reads, so they get the larger one.
+# Every stage has a timeout, and on timeout or error the call is retried once
+# on the other model. Calls go through openai_client at interactive priority. Override with AGENT_MODEL_<STAGE>,
+# AGENT_FALLBACK_<STAGE> and AGENT_TIMEOUT_<STAGE> (seconds).
+STAGE_DEFAULTS = {
+    # stage: (model, fallback, timeout)
+    "router": ("gpt-4o-mini", "gpt-4o", 5),
+    "sql": ("gpt-4o-mini", "gpt-4o", 15),
+    "memory": ("gpt-4o-mini", "gpt-4o", 10),
+    "vector": ("gpt-4o", "gpt-4o-mini", 20),
+    "general": ("gpt-4o", "gpt-4o-mini", 20),
+    # tool-calling mode: picks the tool and may answer directly, so the larger model
+    "agent": ("gpt-4o", "gpt-4o-mini", 20),
+}
+
+BASELINE_MODEL = "gpt-4"  # what every stage used before tiering
+STAGE_REPORT = os.getenv("AGENT_STAGE_REPORT", "stage_report.json")
+
+# USD per 1M (input, output) tokens; longest matching prefix wins
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+
+def price_for(model):
+    for prefix in sorted(PRICES, key=len, reverse=True):
+        if (model or "").startswith(prefix):
+            return PRICES[prefix]
+    return (0.0, 0.0)
+
+
+def cost(model, prompt_tokens, completion_tokens):
+    price_in, price_out = price_for(model)
+    return (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+
+class StageStats(BaseCallbackHandler):
+    """Latency, tokens and cost per stage, fed by LangChain callbacks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = {}
+        self.stages = {}
+
+    def _stage(self, stage):
+        return self.stages.setdefault(stage, {
+            "latency": Series(), "calls": 0, "errors": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "baseline_cost": 0.0,
+        })
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        with self._lock:
+            self._started[run_id] = ((metadata or {}).get("stage", "unknown"), time.monotonic())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, metadata=metadata)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        output = response.llm_output or {}
+        usage = output.get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        with self._lock:
+            stage, started = self._started.pop(run_id, ("unknown", time.monotonic()))
+            stats = self._stage(stage)
+            stats["latency"].observe(time.monotonic() - started)
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cost"] += cost(output.get("model_name"), prompt_tokens, completion_tokens)
+            stats["baseline_cost"] += cost(BASELINE_MODEL, prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            stage, _ = self._started.pop(run_id, ("unknown", None))
+            self._stage(stage)["errors"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: {
+                    **{k: v for k, v in stats.items() if k != "latency"},
+                    "latency": stats["latency"].summary(),
+                }
+                for stage, stats in self.stages.items()
+            }
+
+    def report(self, path=STAGE_REPORT):
+        """Print per-stage latency and cost against gpt-4 for the same tokens; save as JSON"""
+        snap = self.snapshot()
+        print(f"{'stage':<8} {'calls':>5} {'err':>4} {'p50 s':>7} {'p95 s':>7} {'cost $':>9} {'gpt-4 $':>9}")
+        for stage, s in sorted(snap.items()):
+            print(
+                f"{stage:<8} {s['calls']:>5} {s['errors']:>4} {s['latency']['p50']:>7.2f} "
+                f"{s['latency']['p95']:>7.2f} {s['cost']:>9.4f} {s['baseline_cost']:>9.4f}"
+            )
+        if path:
+            with open(path, "w") as f:
+                json.dump(snap, f, indent=2)
+        return snap
+
+
+stats = StageStats()
+
+
+def stage_config(stage):
+    model, fallback, timeout = STAGE_DEFAULTS[stage]
+    key = stage.upper()
+    return (
+        os.getenv(f"AGENT_MODEL_{key}", model),
+        os.getenv(f"AGENT_FALLBACK_{key}", fallback),
+        float(os.getenv(f"AGENT_TIMEOUT_{key}", str(timeout))),
+    )
+
+
+def stage_llm(stage, tools=None):
+    """
+    ChatOpenAI for a stage with its timeout, falling back to the alternate model.
+    tools are bound to both models, before the fallback is attached.
+    """
+    model, fallback, timeout = stage_config(stage)
+    options = {"temperature": 0, "callbacks": [stats], "metadata": {"stage": stage}}
+
+    def build(name, timeout):
+        llm = chat_model(INTERACTIVE, model=name, timeout=timeout, **options)
+        return llm.bind_tools(tools) if tools else llm
+
+    primary = build(model, timeout)
+    if not fallback or fallback == model:
+        return primary
+    # the fallback gets twice the time, it only runs when something already went wrong
+    return primary.with_fallbacks([build(fallback, timeout * 2)])
+
+
+def compare(before_path, after_path):
+    """python model_tiers.py before.json after.json: per-stage latency and cost change"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{'stage':<8} {'p50 s':>15} {'p95 s':>15} {'$ / call':>21}")
+    for stage in sorted(set(before) | set(after)):
+        b, a = before.get(stage), after.get(stage)
+        if not b or not a or not b["calls"] or not a["calls"]:
+            continue
+        print(
+            f"{stage:<8} {b['latency']['p50']:>6.2f} -> {a['latency']['p50']:<6.2f}"
+            f" {b['latency']['p95']:>6.2f} -> {a['latency']['p95']:<6.2f}"
+            f" {b['cost'] / b['calls']:>8.5f} -> {a['cost'] / a['calls']:<8.5f}"
+        )
+
+
+if __name__ == "__main__":
+    compare(sys.argv[1], sys.argv[2])
@@ -0,0 +1,527 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+import weakref
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+# Shared HTTP layer for every OpenAI call. Models built with chat_model() /
+# embeddings_model() share one keep-alive connection pool and one retry
+# policy, and are paced per model against the organization-wide budget.
+#
+# The agent, embed.py, sync.py and add_categories.py are separate processes,
+# so the pacing works from what all of them share:
+# - OpenAI's x-ratelimit-* response headers report the organization's remaining
+#   requests and tokens per model; every process tracks them and batch callers
+#   wait instead of spending past them.
+# - Interactive callers (the agent) announce themselves in Postgres
+#   (openai_presence). While any process has made interactive calls in the
+#   last OPENAI_INTERACTIVE_WINDOW seconds, batch callers everywhere leave
+#   OPENAI_INTERACTIVE_RESERVE of the budget to them; otherwise batch jobs may
+#   use all of it.
+# Interactive callers never wait on the shared budget, only on a 429.
+#
+# OPENAI_RPM / OPENAI_TPM (or OPENAI_RPM_<MODEL>, e.g.
+# OPENAI_TPM_TEXT_EMBEDDING_3_SMALL) optionally cap a single process on top.
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "0"))  # 0: no per-process cap
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "0"))
+INTERACTIVE_RESERVE = float(os.getenv("OPENAI_INTERACTIVE_RESERVE", "0.2"))
+INTERACTIVE_WINDOW = float(os.getenv("OPENAI_INTERACTIVE_WINDOW", "120"))
+# share interactive presence through Postgres; off: only within this process
+PRESENCE = os.getenv("OPENAI_PRESENCE", "1") == "1"
+PRESENCE_INTERVAL = 5.0  # seconds between presence writes / reads
+# interactive calls have stage timeouts and fallbacks, so they retry little
+MAX_RETRIES = {
+    INTERACTIVE: int(os.getenv("OPENAI_INTERACTIVE_RETRIES", "1")),
+    BATCH: int(os.getenv("OPENAI_BATCH_RETRIES", "6")),
+}
+BACKOFF_BASE = 0.5  # seconds, doubled per attempt
+BACKOFF_MAX = 60.0
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+# timeouts are not retried; the caller's timeout covers waiting, retries and the request
+RETRY_ERRORS = (httpx.ConnectError, httpx.RemoteProtocolError)
+DEFAULT_COMPLETION_TOKENS = 500  # counted when a chat request sets no max_tokens
+MAX_SLEEP = 1.0  # re-check the buckets at least this often while waiting
+POOL_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=20,
+    keepalive_expiry=60,
+)
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 per second, up to per_minute"""
+
+    def __init__(self, per_minute, level=None):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute if level is None else level
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def clamp(self, amount, reserve):
+        # a request larger than the usable bucket goes once the bucket is full
+        return min(amount, self.capacity * (1 - reserve))
+
+    def wait_for(self, amount, reserve):
+        """Seconds until amount can be taken without going below the reserve"""
+        missing = self.clamp(amount, reserve) + self.capacity * reserve - self.level
+        return max(missing, 0.0) / self.rate
+
+    def take(self, amount, reserve):
+        self.level -= self.clamp(amount, reserve)
+
+
+class Presence:
+    """
+    Whether interactive traffic is live anywhere. Reads and writes go to
+    Postgres from a background thread, never from the calling thread or the
+    event loop; until the first read succeeds, interactive traffic is assumed.
+    """
+
+    DDL = """
+        CREATE UNLOGGED TABLE IF NOT EXISTS openai_presence (
+            priority TEXT PRIMARY KEY,
+            last_seen TIMESTAMPTZ NOT NULL
+        )
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._busy = False
+        self.last_local = 0.0  # last interactive call in this process
+        self._announced = 0.0
+        self._checked = 0.0
+        self._remote = PRESENCE
+        self._warned = False
+
+    def mark(self):
+        """Called for every interactive request"""
+        now = time.monotonic()
+        self.last_local = now
+        if PRESENCE and now - self._announced >= PRESENCE_INTERVAL:
+            self._announced = now
+            self._background(
+                "INSERT INTO openai_presence (priority, last_seen) VALUES ('interactive', now()) "
+                "ON CONFLICT (priority) DO UPDATE SET last_seen = now()"
+            )
+
+    def interactive_active(self):
+        now = time.monotonic()
+        if now - self.last_local < INTERACTIVE_WINDOW:
+            return True
+        if PRESENCE and now - self._checked >= PRESENCE_INTERVAL:
+            self._checked = now
+            self._background(
+                "SELECT last_seen > now() - make_interval(secs => %s) "
+                "FROM openai_presence WHERE priority = 'interactive'",
+                (INTERACTIVE_WINDOW,), read=True,
+            )
+        return self._remote
+
+    def _background(self, query, params=(), read=False):
+        with self._lock:
+            if self._busy:
+                return
+            self._busy = True
+        threading.Thread(target=self._run, args=(query, params, read), daemon=True).start()
+
+    def _run(self, query, params, read):
+        try:
+            if self._conn is None or self._conn.closed:
+                from db import get_connection
+                self._conn = get_connection(autocommit=True)
+                self._conn.execute(self.DDL)
+            row = self._conn.execute(query, params).fetchone() if read else None
+            if read:
+                self._remote = bool(row and row[0])
+        except Exception as e:
+            if read:
+                self._remote = True  # unknown: keep the reserve
+            if not self._warned:
+                self._warned = True
+                print(f"OpenAI presence unavailable, batch calls keep the interactive reserve: {e}")
+        finally:
+            with self._lock:
+                self._busy = False
+
+
+presence = Presence()
+
+
+class RateLimiter:
+    """
+    Pacing for one model: the organization's budget as the last response
+    reported it, an optional per-process cap, and a pause after a 429.
+    """
+
+    def __init__(self, rpm, tpm):
+        self._lock = threading.Lock()
+        # per-process caps, each only when configured
+        self.local = {kind: TokenBucket(limit) for kind, limit in (("requests", rpm), ("tokens", tpm)) if limit}
+        self.org = {}  # "requests"/"tokens" -> TokenBucket from the response headers
+        self.paused_until = 0.0
+        self.waiting = {INTERACTIVE: 0, BATCH: 0}
+
+    def observe(self, headers):
+        """Take the organization-wide budget from a response"""
+        with self._lock:
+            for kind in ("requests", "tokens"):
+                try:
+                    limit = float(headers[f"x-ratelimit-limit-{kind}"])
+                    remaining = float(headers[f"x-ratelimit-remaining-{kind}"])
+                except (KeyError, ValueError):
+                    continue
+                if limit > 0:
+                    self.org[kind] = TokenBucket(limit, level=remaining)
+
+    def _try(self, tokens, priority, interactive_active):
+        """0 if the call may go now (its share is taken), otherwise seconds to wait"""
+        now = time.monotonic()
+        amounts = {"requests": 1, "tokens": tokens}
+        with self._lock:
+            if now < self.paused_until:
+                return self.paused_until - now
+            if priority == BATCH and self.waiting[INTERACTIVE]:
+                return 0.05
+
+            # (bucket, amount, reserve); on the shared budget batch leaves the
+            # reserve, and only while interactive traffic is around to need it
+            buckets = [(bucket, amounts[kind], 0.0) for kind, bucket in self.local.items()]
+            if priority == BATCH:
+                reserve = INTERACTIVE_RESERVE if interactive_active else 0.0
+                buckets += [(bucket, amounts[kind], reserve) for kind, bucket in self.org.items()]
+            for bucket, _, _ in buckets:
+                bucket.refill(now)
+            wait = max((bucket.wait_for(amount, reserve) for bucket, amount, reserve in buckets), default=0.0)
+            if wait == 0:
+                for bucket, amount, reserve in buckets:
+                    bucket.take(amount, reserve)
+                if priority == INTERACTIVE:
+                    # not waited on, but the batch side should see it spent
+                    for kind, bucket in self.org.items():
+                        bucket.refill(now)
+                        bucket.take(amounts[kind], 0.0)
+            return wait
+
+    def _set_waiting(self, priority, delta):
+        with self._lock:
+            self.waiting[priority] += delta
+
+    @staticmethod
+    def _check(wait, deadline):
+        if deadline is not None and time.monotonic() + wait > deadline:
+            raise TimeoutError(f"waiting {wait:.1f}s for the OpenAI rate limit would pass the caller's timeout")
+
+    def acquire(self, tokens, priority, deadline=None):
+        """Block until the call fits; returns the seconds waited. TimeoutError past deadline."""
+        wait = self._try(tokens, priority, priority == BATCH and presence.interactive_active())
+        if not wait:
+            return 0.0
+        started = time.monotonic()
+        self._set_waiting(priority, 1)
+        try:
+            while wait:
+                self._check(wait, deadline)
+                time.sleep(min(wait, MAX_SLEEP))
+                wait = self._try(tokens, priority, priority == BATCH and presence.interactive_active())
+        finally:
+            self._set_waiting(priority, -1)
+        return time.monotonic() - started
+
+    async def acquire_async(self, tokens, priority, deadline=None):
+        wait = self._try(tokens, priority, priority == BATCH and presence.interactive_active())
+        if not wait:
+            return 0.0
+        started = time.monotonic()
+        self._set_waiting(priority, 1)
+        try:
+            while wait:
+                self._check(wait, deadline)
+                await asyncio.sleep(min(wait, MAX_SLEEP))
+                wait = self._try(tokens, priority, priority == BATCH and presence.interactive_active())
+        finally:
+            self._set_waiting(priority, -1)
+        return time.monotonic() - started
+
+    def pause(self, seconds):
+        """The server said slow down: hold every caller of this model"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+_lock = threading.Lock()
+_share = 1.0
+_limiters = {}
+_stats = {}
+
+
+def set_share(fraction):
+    """Use only this fraction of OPENAI_RPM / OPENAI_TPM in this process"""
+    global _share
+    with _lock:
+        _share = fraction
+        _limiters.clear()
+
+
+def _limit(name, model, default):
+    key = model.upper().replace("-", "_").replace(".", "_")
+    return float(os.getenv(f"OPENAI_{name}_{key}", str(default))) * _share
+
+
+def limiter_for(model):
+    with _lock:
+        if model not in _limiters:
+            _limiters[model] = RateLimiter(_limit("RPM", model, OPENAI_RPM), _limit("TPM", model, OPENAI_TPM))
+        return _limiters[model]
+
+
+def _record(priority, **counts):
+    with _lock:
+        stats = _stats.setdefault(
+            priority, {"requests": 0, "retries": 0, "throttled": 0, "timeouts": 0, "waited_seconds": 0.0}
+        )
+        for name, value in counts.items():
+            stats[name] += value
+
+
+def _count_tokens(value):
+    # ~4 characters per token is close enough for budgeting; token id lists are exact
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value) // 4 + 1
+    if isinstance(value, list):
+        if value and all(isinstance(v, int) for v in value):
+            return len(value)
+        return sum(_count_tokens(v) for v in value)
+    return _count_tokens(json.dumps(value))
+
+
+def estimate(request):
+    """(model, tokens) for a request, counted the way OpenAI counts against the limit"""
+    try:
+        body = json.loads(request.content or b"{}")
+    except (ValueError, httpx.RequestNotRead):
+        return "unknown", DEFAULT_COMPLETION_TOKENS
+    model = body.get("model", "unknown")
+    if "input" in body:  # embeddings
+        return model, _count_tokens(body["input"])
+    prompt = sum(_count_tokens(m.get("content")) for m in body.get("messages", []))
+    prompt += _count_tokens(body.get("tools"))
+    completion = body.get("max_completion_tokens") or body.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return model, prompt + completion
+
+
+def retry_delay(attempt, response=None):
+    """Jittered exponential backoff, never shorter than the server's Retry-After"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    delay = random.uniform(delay / 2, delay)
+    if response is not None:
+        try:
+            if "retry-after-ms" in response.headers:
+                delay = max(delay, float(response.headers["retry-after-ms"]) / 1000)
+            elif "retry-after" in response.headers:
+                delay = max(delay, float(response.headers["retry-after"]))
+        except ValueError:
+            pass
+    return min(delay, BACKOFF_MAX)
+
+
+def deadline_for(request):
+    """
+    The caller's timeout (the SDK passes the model's timeout as the read
+    timeout) as a deadline for rate-limit waits, retries and the request itself
+    """
+    timeout = request.extensions.get("timeout") or {}
+    budget = timeout.get("read")
+    return None if budget is None else time.monotonic() + budget
+
+
+def _past(deadline, delay=0.0):
+    return deadline is not None and time.monotonic() + delay >= deadline
+
+
+def _fit_timeout(request, deadline):
+    """Shrink the request's own timeouts to what is left of the deadline"""
+    if deadline is None:
+        return
+    left = max(deadline - time.monotonic(), 0.001)
+    timeout = request.extensions.get("timeout") or {}
+    request.extensions["timeout"] = {
+        name: left if value is None else min(value, left) for name, value in timeout.items()
+    }
+
+
+def _timed_out(request, priority, error):
+    _record(priority, timeouts=1)
+    return httpx.PoolTimeout(str(error), request=request)
+
+
+# one connection pool for all sync clients; async pools are per event loop,
+# since connections cannot move between loops. Code that runs its own loops
+# closes the pool with aclose_pool() before the loop ends.
+_pool = httpx.HTTPTransport(limits=POOL_LIMITS)
+_async_pools = weakref.WeakKeyDictionary()
+
+
+def _async_pool():
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if loop not in _async_pools:
+            _async_pools[loop] = httpx.AsyncHTTPTransport(limits=POOL_LIMITS)
+        return _async_pools[loop]
+
+
+async def aclose_pool():
+    """Close the running event loop's connection pool, if it has one"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        transport = _async_pools.pop(loop, None)
+    if transport is not None:
+        await transport.aclose()
+
+
+class LimitedTransport(httpx.BaseTransport):
+    """Paces and retries requests within the caller's timeout, then hands them to the shared pool"""
+
+    def __init__(self, priority):
+        self.priority = priority
+
+    def handle_request(self, request):
+        model, tokens = estimate(request)
+        limiter = limiter_for(model)
+        deadline = deadline_for(request)
+        retries = MAX_RETRIES[self.priority]
+        if self.priority == INTERACTIVE:
+            presence.mark()
+        for attempt in range(retries + 1):
+            try:
+                waited = limiter.acquire(tokens, self.priority, deadline)
+            except TimeoutError as e:
+                raise _timed_out(request, self.priority, e)
+            _record(self.priority, requests=1, waited_seconds=waited)
+            _fit_timeout(request, deadline)
+            try:
+                response = _pool.handle_request(request)
+            except RETRY_ERRORS:
+                delay = retry_delay(attempt)
+                if attempt == retries or _past(deadline, delay):
+                    raise
+                _record(self.priority, retries=1)
+                time.sleep(delay)
+                continue
+            limiter.observe(response.headers)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            delay = retry_delay(attempt, response)
+            if response.status_code == 429:
+                _record(self.priority, throttled=1)
+                limiter.pause(delay)
+            if _past(deadline, delay):
+                # no time left to retry: the caller sees the error and can fall back
+                return response
+            response.close()
+            _record(self.priority, retries=1)
+            time.sleep(delay)
+
+
+class AsyncLimitedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, priority):
+        self.priority = priority
+
+    async def handle_async_request(self, request):
+        model, tokens = estimate(request)
+        limiter = limiter_for(model)
+        deadline = deadline_for(request)
+        retries = MAX_RETRIES[self.priority]
+        if self.priority == INTERACTIVE:
+            presence.mark()
+        for attempt in range(retries + 1):
+            try:
+                waited = await limiter.acquire_async(tokens, self.priority, deadline)
+            except TimeoutError as e:
+                raise _timed_out(request, self.priority, e)
+            _record(self.priority, requests=1, waited_seconds=waited)
+            _fit_timeout(request, deadline)
+            try:
+                response = await _async_pool().handle_async_request(request)
+            except RETRY_ERRORS:
+                delay = retry_delay(attempt)
+                if attempt == retries or _past(deadline, delay):
+                    raise
+                _record(self.priority, retries=1)
+                await asyncio.sleep(delay)
+                continue
+            limiter.observe(response.headers)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            delay = retry_delay(attempt, response)
+            if response.status_code == 429:
+                _record(self.priority, throttled=1)
+                limiter.pause(delay)
+            if _past(deadline, delay):
+                return response
+            await response.aclose()
+            _record(self.priority, retries=1)
+            await asyncio.sleep(delay)
+
+
+_clients = {}
+
+
+def http_client(priority=INTERACTIVE):
+    with _lock:
+        if ("sync", priority) not in _clients:
+            _clients["sync", priority] = httpx.Client(transport=LimitedTransport(priority))
+        return _clients["sync", priority]
+
+
+def async_http_client(priority=INTERACTIVE):
+    with _lock:
+        if ("async", priority) not in _clients:
+            _clients["async", priority] = httpx.AsyncClient(transport=AsyncLimitedTransport(priority))
+        return _clients["async", priority]
+
+
+def _client_options(priority, kwargs):
+    # retries happen in the transport, where they are paced too
+    return {
+        "http_client": http_client(priority),
+        "http_async_client": async_http_client(priority),
+        "max_retries": 0,
+        **kwargs,
+    }
+
+
+def chat_model(priority=INTERACTIVE, **kwargs):
+    return ChatOpenAI(**_client_options(priority, kwargs))
+
+
+def embeddings_model(priority=INTERACTIVE, **kwargs):
+    return OpenAIEmbeddings(**_client_options(priority, kwargs))
+
+
+def snapshot():
+    with _lock:
+        return {priority: dict(stats) for priority, stats in _stats.items()}
+
+
+def report():
+    for priority, s in sorted(snapshot().items()):
+        print(
+            f"OpenAI {priority}: {s['requests']} requests, {s['retries']} retries, "
+            f"{s['throttled']} throttled (429), {s['timeouts']} timed out waiting, "
+            f"{s['waited_seconds']:.1f}s waiting for rate limits"
+        )
@@ -1,14 +1,15 @@
 from qdrant_client import QdrantClient
 from qdrant_client.models import VectorParams, Distance
-from langchain_openai import OpenAIEmbeddings
 from langchain_qdrant import QdrantVectorStore
+from openai_client import INTERACTIVE, embeddings_model
 
 QDRANT_URL = "http://localhost:6333"
 COLLECTION_NAME = "postgres_v2"
 
 qdrant = QdrantClient(url=QDRANT_URL)
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# query embeddings for the agent; batch jobs build their own at batch priority
+embeddings = embeddings_model(INTERACTIVE, model="text-embedding-3-small")
 
 # checks before creating
 # if not qdrant.collection_exists(COLLECTION_NAME):
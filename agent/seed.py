@@ -1,4 +1,6 @@
+import io
 import os
+import csv
 import uuid
 import random
 from datetime import datetime
@@ -10,10 +12,14 @@ load_dotenv()
 
 # db config
 DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError(
-        "DATABASE_URL not configured. Either set env var DATABASE_URL or provide it in .env"
-    )
+
+def require_database_url():
+    # checked when connecting, so the catalog helpers can be imported without a database
+    if not DATABASE_URL:
+        raise RuntimeError(
+            "DATABASE_URL not configured. Either set env var DATABASE_URL or provide it in .env"
+        )
+    return DATABASE_URL
 
 random.seed(42)
 
@@ -416,78 +422,133 @@ def create_tables(conn, drop_existing=True):
         """)
         conn.commit()
 
+COPY_CHUNK_ROWS = 50000  # rows buffered per COPY; orders are generated in chunks of this size
+
+def copy_rows(cur, table, columns, rows, chunk_rows=COPY_CHUNK_ROWS):
+    """COPY an iterable of tuples into table in CSV chunks. Returns the row count."""
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    count = 0
+
+    def flush():
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+        buf.seek(0)
+        buf.truncate()
+
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % chunk_rows == 0:
+            flush()
+    if buf.tell():
+        flush()
+    return count
+
+def next_id(cur, table, pk):
+    cur.execute(f"SELECT coalesce(max({pk}), 0) + 1 FROM {table}")
+    return cur.fetchone()[0]
+
+def reset_sequence(cur, table, pk):
+    # ids were assigned client-side, move the SERIAL past them
+    cur.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', '{pk}'), "
+        f"coalesce((SELECT max({pk}) FROM {table}), 1))"
+    )
+
+# lookups support questions make all the time; created after loading, which is faster
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS orders_user_id_idx ON orders (user_id)",
+    "CREATE INDEX IF NOT EXISTS orders_status_idx ON orders (status)",
+    "CREATE INDEX IF NOT EXISTS order_items_order_id_idx ON order_items (order_id)",
+    "CREATE INDEX IF NOT EXISTS order_items_product_id_idx ON order_items (product_id)",
+]
+
+def create_indexes(conn):
+    with conn.cursor() as cur:
+        for ddl in INDEXES:
+            cur.execute(ddl)
+        cur.execute("ANALYZE")
+    conn.commit()
+
 def seed_data(
     conn,
     num_users=5000,
     num_orders=30000,
     product_variant_multiplier=1  # master catalog is already big; set >1 to explode SKUs
 ):
+    """
+    Rows are generated in Python with ids assigned client-side and order totals
+    computed up front, then loaded with COPY: a few round trips per table
+    instead of one per row.
+    """
     fake = Faker()
     with conn.cursor() as cur:
         # Users
-        for _ in range(num_users):
-            cur.execute(
-                "INSERT INTO users (name, address) VALUES (%s, %s)",
-                (fake.name(), fake.address().replace("\n", ", ")),
-            )
+        first_user = next_id(cur, "users", "user_id")
+        user_ids = list(range(first_user, first_user + num_users))
+        copy_rows(cur, "users", ("user_id", "name", "address"), (
+            (user_id, fake.name(), fake.address().replace("\n", ", "))
+            for user_id in user_ids
+        ))
 
         # Products
         master = build_master_catalog()
         product_list = expand_products(master, multiplier=product_variant_multiplier)
-        for p in product_list:
-            cur.execute(
-                "INSERT INTO products (name, description, price, stock_quantity) VALUES (%s, %s, %s, %s)",
-                (p["name"], p["description"], p["price"], p["stock_quantity"]),
-            )
-
-        # IDs 
-        cur.execute("SELECT user_id FROM users")
-        user_ids = [r[0] for r in cur.fetchall()]
-
-        cur.execute("SELECT product_id, price FROM products")
-        product_rows = cur.fetchall()
-        product_ids = [r[0] for r in product_rows]
-        price_map = {pid: float(price) for pid, price in product_rows}
+        first_product = next_id(cur, "products", "product_id")
+        product_ids = list(range(first_product, first_product + len(product_list)))
+        price_map = {pid: p["price"] for pid, p in zip(product_ids, product_list)}
+        copy_rows(cur, "products", ("product_id", "name", "description", "price", "stock_quantity"), (
+            (pid, p["name"], p["description"], p["price"], p["stock_quantity"])
+            for pid, p in zip(product_ids, product_list)
+        ))
 
         # orders & items
         statuses = ["pending", "shipped", "delivered", "cancelled"]
         # most are delivered/shipped
         status_weights = [0.15, 0.35, 0.45, 0.05]
 
-        for _ in range(num_orders):
-            user_id = random.choice(user_ids)
-            order_date = fake.date_time_between(start_date="-3y", end_date="now")
-            status = random.choices(statuses, weights=status_weights, k=1)[0]
-            order_number = f"ORD-{uuid.uuid4()}"
-            cur.execute(
-                "INSERT INTO orders (order_number, user_id, order_date, status, total_amount) "
-                "VALUES (%s, %s, %s, %s, 0) RETURNING order_id",
-                (order_number, user_id, order_date, status),
-            )
-            order_id = cur.fetchone()[0]
-
-            num_items = random.randint(1, 5)
-            total = 0.0
-            chosen = random.sample(product_ids, k=num_items)
-            for pid in chosen:
-                qty = random.randint(1, 3)
-                price = price_map[pid]
-                total += price * qty
-                cur.execute(
-                    "INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (%s, %s, %s, %s)",
-                    (order_id, pid, qty, price),
-                )
-
-            cur.execute(
-                "UPDATE orders SET total_amount = %s WHERE order_id = %s",
-                (round(total, 2), order_id),
-            )
+        order_id = next_id(cur, "orders", "order_id")
+        order_item_id = next_id(cur, "order_items", "order_item_id")
+        remaining = num_orders
+        while remaining > 0:
+            orders, items = [], []
+            for _ in range(min(COPY_CHUNK_ROWS, remaining)):
+                user_id = random.choice(user_ids)
+                order_date = fake.date_time_between(start_date="-3y", end_date="now")
+                status = random.choices(statuses, weights=status_weights, k=1)[0]
+                order_number = f"ORD-{uuid.uuid4()}"
+
+                num_items = random.randint(1, 5)
+                total = 0.0
+                chosen = random.sample(product_ids, k=num_items)
+                for pid in chosen:
+                    qty = random.randint(1, 3)
+                    price = price_map[pid]
+                    total += price * qty
+                    items.append((order_item_id, order_id, pid, qty, price))
+                    order_item_id += 1
+
+                orders.append((order_id, order_number, user_id, order_date, status, round(total, 2)))
+                order_id += 1
+
+            copy_rows(cur, "orders",
+                      ("order_id", "order_number", "user_id", "order_date", "status", "total_amount"), orders)
+            copy_rows(cur, "order_items",
+                      ("order_item_id", "order_id", "product_id", "quantity", "price"), items)
+            remaining -= len(orders)
+            print(f"  {num_orders - remaining}/{num_orders} orders")
+
+        for table, pk in (("users", "user_id"), ("products", "product_id"),
+                          ("orders", "order_id"), ("order_items", "order_item_id")):
+            reset_sequence(cur, table, pk)
 
         conn.commit()
 
 def main():
     print(f"[{datetime.utcnow().isoformat()}] Connecting to PostgreSQL...")
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = psycopg2.connect(require_database_url())
     try:
         print("Creating tables...")
         create_tables(conn, drop_existing=True)
@@ -498,6 +559,8 @@ def main():
             num_orders=int(os.getenv("SEED_ORDERS", "30000")),
             product_variant_multiplier=int(os.getenv("SEED_VARIANTS", "1"))
         )
+        print("Creating indexes...")
+        create_indexes(conn)
         print("Done.")
     finally:
         conn.close()
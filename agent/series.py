@@ -0,0 +1,34 @@
+from collections import deque
+
+WINDOW = 1000  # recent observations kept per series for percentiles
+
+
+class Series:
+    """Count, sum and max since start, plus a recent window for percentiles"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else 0.0,
+            "p50": round(self.percentile(0.50), 4),
+            "p95": round(self.percentile(0.95), 4),
+            "max": round(self.max, 4),
+        }
@@ -0,0 +1,124 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from token_batching import count_tokens, truncate_text
+
+# Per-session conversation memory for the support agent. Recent turns are kept
+# verbatim; once a session goes over its token budget the oldest turns are
+# folded into a rolling summary, so the history put in front of every prompt
+# stays roughly the same size however long the chat runs. Summaries are written
+# in the background, off the request path; until one lands the turns it will
+# replace stay in the history as they are.
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))
+SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+MAX_ANSWER_TOKENS = 300  # long answers are remembered cut short
+SUMMARY_WORKERS = int(os.getenv("MEMORY_SUMMARY_WORKERS", "2"))
+
+SUMMARY_PROMPT = """Summarize this customer support conversation for the agent's own notes.
+Keep order numbers, product names, prices, the customer's preferences and anything
+still unresolved. At most a few sentences.
+
+{conversation}
+
+Summary:"""
+
+
+class Session:
+    def __init__(self):
+        self.summary = ""
+        self.summary_tokens = 0
+        self.turns = deque()  # (question, answer, tokens)
+        self.turn_tokens = 0
+        self.last_used = time.monotonic()
+        self.compacting = False  # a summary is being written for this session
+        self.lock = threading.Lock()
+
+    def history(self):
+        parts = []
+        if self.summary:
+            parts.append(f"Earlier in this conversation: {self.summary}")
+        for question, answer, _ in self.turns:
+            parts.append(f"Customer: {question}\nAgent: {answer}")
+        return "\n".join(parts)
+
+
+class SessionMemory:
+    """
+    Sessions by id, least recently used first. summarize(text) -> str is the
+    LLM call used to fold old turns into the summary.
+    """
+
+    def __init__(self, summarize, budget=MEMORY_TOKEN_BUDGET):
+        self.summarize = summarize
+        self.budget = budget
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="memory-summary")
+
+    def _session(self, session_id):
+        with self.lock:
+            self.evict_idle()
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = Session()
+                while len(self.sessions) > MAX_SESSIONS:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            return session
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - SESSION_IDLE_SECONDS
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.last_used >= cutoff:
+                break
+            del self.sessions[session_id]
+
+    def history(self, session_id):
+        """Summary plus recent turns, as text for a prompt ('' for a new session)"""
+        session = self._session(session_id)
+        with session.lock:
+            return session.history()
+
+    def add_turn(self, session_id, question, answer):
+        session = self._session(session_id)
+        with session.lock:
+            answer, _ = truncate_text(str(answer), MAX_ANSWER_TOKENS)
+            tokens = count_tokens(question) + count_tokens(answer)
+            session.turns.append((question, answer, tokens))
+            session.turn_tokens += tokens
+            self._schedule(session)
+
+    def _schedule(self, session):
+        # caller holds session.lock; one summary per session at a time
+        if session.compacting or session.turn_tokens + session.summary_tokens <= self.budget:
+            return
+        # fold the older half of the turns (at least one) into the summary
+        folded = list(session.turns)[:max(1, len(session.turns) // 2)]
+        lines = [f"Earlier summary: {session.summary}"] if session.summary else []
+        lines += [f"Customer: {q}\nAgent: {a}" for q, a, _ in folded]
+        session.compacting = True
+        self.pool.submit(self._compact, session, len(folded), "\n".join(lines))
+
+    def _compact(self, session, folded, conversation):
+        try:
+            summary = self.summarize(SUMMARY_PROMPT.format(conversation=conversation))
+        except Exception as e:
+            # the turns stay as they are; the next turn tries again
+            print(f"Conversation summary failed: {e}")
+            with session.lock:
+                session.compacting = False
+            return
+        summary, summary_tokens = truncate_text(summary.strip(), SUMMARY_TOKENS)
+        with session.lock:
+            # turns are only ever appended, so the folded ones are still in front
+            for _ in range(folded):
+                session.turn_tokens -= session.turns.popleft()[2]
+            session.summary, session.summary_tokens = summary, summary_tokens
+            session.compacting = False
+            self._schedule(session)
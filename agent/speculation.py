@@ -0,0 +1,94 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# requests the agent is expected to answer at once; each can have one
+# speculative job, so a smaller pool queues them behind each other
+AGENT_CONCURRENCY = int(os.getenv("AGENT_CONCURRENCY", "8"))
+
+
+class Speculator:
+    """
+    Runs work before we know it is needed (product retrieval while the router
+    decides) and keeps score: how often the result was used and how much
+    latency that hid, versus how much work was thrown away.
+    """
+
+    def __init__(self, max_workers=AGENT_CONCURRENCY):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculate")
+        self._lock = threading.Lock()
+        self.counts = {"used": 0, "wasted": 0, "cancelled": 0, "failed": 0, "inline": 0}
+        self.saved_seconds = 0.0
+        self.wasted_seconds = 0.0
+
+    @staticmethod
+    def _timed(fn, *args):
+        start = time.monotonic()
+        return fn(*args), time.monotonic() - start
+
+    def start(self, fn, *args):
+        return self.pool.submit(self._timed, fn, *args)
+
+    def finish(self, future, use):
+        """
+        The result if use is true, otherwise drop it. None when the job failed or
+        never got a worker; the caller then does the work itself.
+        """
+        if not use:
+            if future.cancel():
+                self._count("cancelled")
+            else:
+                # let it finish in the background, only to account for it
+                future.add_done_callback(self._discard)
+            return None
+
+        if future.cancel():
+            # still queued behind other jobs: waiting for it would only add latency
+            self._count("inline")
+            return None
+
+        waited_from = time.monotonic()
+        try:
+            result, duration = future.result()
+        except Exception as e:
+            print(f"Speculative retrieval failed, retrying inline: {e}")
+            self._count("failed")
+            return None
+        waited = time.monotonic() - waited_from
+        with self._lock:
+            self.counts["used"] += 1
+            # the part of the work that ran while routing
+            self.saved_seconds += max(duration - waited, 0.0)
+        return result
+
+    def _discard(self, future):
+        if future.exception() is not None:
+            self._count("failed")
+            return
+        _, duration = future.result()
+        with self._lock:
+            self.counts["wasted"] += 1
+            self.wasted_seconds += duration
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                **self.counts,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "wasted_seconds": round(self.wasted_seconds, 3),
+            }
+
+    def report(self):
+        snap = self.snapshot()
+        print(
+            f"Speculative retrieval: {snap['used']} used ({snap['saved_seconds']}s hidden behind routing), "
+            f"{snap['wasted']} wasted ({snap['wasted_seconds']}s of retrieval), "
+            f"{snap['cancelled']} cancelled before starting, {snap['inline']} still queued and run inline, "
+            f"{snap['failed']} failed"
+        )
+        return snap
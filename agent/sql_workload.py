@@ -0,0 +1,162 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import text
+from langchain_community.utilities import SQLDatabase
+from db import get_connection
+
+# Workload capture for the SQL the agent's chain generates, and an index
+# advisor that reads it back. Every statement is logged with its run time;
+# slow ones also get their EXPLAIN plan, which is what the advisor works from.
+SQL_WORKLOAD_LOG = os.getenv("SQL_WORKLOAD_LOG", "sql_workload.jsonl")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+MIN_TABLE_ROWS = 10000  # seq scans on smaller tables are fine
+
+_log_lock = threading.Lock()
+
+
+def record(entry):
+    entry["at"] = datetime.utcnow().isoformat()
+    with _log_lock, open(SQL_WORKLOAD_LOG, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+class WorkloadSQLDatabase(SQLDatabase):
+    """SQLDatabase that logs each query it runs, explaining the slow ones"""
+
+    def run(self, command, *args, parameters=None, **kwargs):
+        start = time.monotonic()
+        try:
+            return super().run(command, *args, parameters=parameters, **kwargs)
+        finally:
+            duration_ms = (time.monotonic() - start) * 1000
+            entry = {"query": command, "duration_ms": round(duration_ms, 2)}
+            if duration_ms >= SLOW_QUERY_MS:
+                entry["plan"] = self.explain(command, parameters)
+                print(f"Slow query ({duration_ms:.0f} ms) logged to {SQL_WORKLOAD_LOG}")
+            record(entry)
+
+    def explain(self, command, parameters=None):
+        if not re.match(r"\s*(select|with)\b", command, re.IGNORECASE):
+            return None
+        try:
+            with self._engine.connect() as conn:
+                plan = conn.execute(text("EXPLAIN (FORMAT JSON) " + command), parameters or {}).scalar()
+                return plan[0]["Plan"]
+        except Exception as e:
+            print(f"EXPLAIN failed: {e}")
+            return None
+
+
+# --- advisor ---
+
+FILTER_COLUMN = re.compile(r"\((?:\w+\.)?(\w+)(?:\)::\w+)? (?:=|<>|<|>|<=|>=|~~\*?) ")
+JOIN_COLUMNS = re.compile(r"(\w+)\.(\w+) = (\w+)\.(\w+)")
+
+
+def walk(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from walk(child)
+
+
+def candidates(plan):
+    """(table, column) pairs a plan had to find by sequential scan"""
+    scanned = {}  # alias -> table
+    found = set()
+    for node in walk(plan):
+        if node.get("Node Type") != "Seq Scan":
+            continue
+        table = node["Relation Name"]
+        scanned[node.get("Alias", table)] = table
+        for column in FILTER_COLUMN.findall(node.get("Filter", "")):
+            found.add((table, column))
+
+    for node in walk(plan):
+        for key in ("Hash Cond", "Merge Cond", "Join Filter"):
+            for left, left_col, right, right_col in JOIN_COLUMNS.findall(node.get(key, "")):
+                for alias, column in ((left, left_col), (right, right_col)):
+                    if alias in scanned:
+                        found.add((scanned[alias], column))
+    return found
+
+
+def existing_indexes(cur):
+    """(table, leading column) of every index"""
+    cur.execute("""
+        SELECT t.relname, a.attname
+        FROM pg_index i
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0]
+    """)
+    return set(cur.fetchall())
+
+
+def table_rows(cur):
+    cur.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'")
+    return dict(cur.fetchall())
+
+
+def recommend(cur, log_path=SQL_WORKLOAD_LOG):
+    """
+    Returns [(table, column, queries, total_ms)] for columns that slow queries
+    seq scanned, with no index leading on them, on tables worth indexing,
+    heaviest first.
+    """
+    usage = defaultdict(lambda: [0, 0.0])
+    with open(log_path) as f:
+        for line in f:
+            entry = json.loads(line)
+            if not entry.get("plan"):
+                continue
+            for candidate in candidates(entry["plan"]):
+                usage[candidate][0] += 1
+                usage[candidate][1] += entry["duration_ms"]
+
+    indexed = existing_indexes(cur)
+    rows = table_rows(cur)
+    advice = [
+        (table, column, count, total_ms)
+        for (table, column), (count, total_ms) in usage.items()
+        if (table, column) not in indexed and rows.get(table, 0) >= MIN_TABLE_ROWS
+    ]
+    return sorted(advice, key=lambda a: a[3], reverse=True)
+
+
+def index_ddl(table, column):
+    return f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {table}_{column}_idx ON {table} ({column})"
+
+
+def main():
+    """python sql_workload.py [--apply]: print index advice, --apply creates the indexes"""
+    apply = "--apply" in sys.argv[1:]
+    if not os.path.exists(SQL_WORKLOAD_LOG):
+        print(f"No workload captured yet ({SQL_WORKLOAD_LOG} missing)")
+        return
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    conn = get_connection(autocommit=True)
+    try:
+        with conn.cursor() as cur:
+            advice = recommend(cur)
+            if not advice:
+                print("No index recommendations")
+                return
+            for table, column, count, total_ms in advice:
+                print(f"{index_ddl(table, column)};  -- {count} slow queries, {total_ms:.0f} ms")
+            if apply:
+                for table, column, _, _ in advice:
+                    cur.execute(index_ddl(table, column))
+                    print(f"Created index on {table}({column})")
+                cur.execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
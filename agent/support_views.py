@@ -0,0 +1,236 @@
+from db import get_connection
+
+# Denormalized tables for the questions support gets most ("what did I order,
+# where is it"), so the SQL chain can answer from one table instead of joining
+# orders, order_items, products and users. sync.py keeps them current from the
+# outbox; running this script (re)builds them from scratch.
+SUPPORT_TABLES = ["order_summary", "user_order_history"]
+
+SUPPORT_VIEWS_DDL = """
+CREATE TABLE IF NOT EXISTS order_summary (
+    order_id INTEGER PRIMARY KEY,
+    order_number VARCHAR(255) NOT NULL,
+    user_id INTEGER,
+    order_date TIMESTAMPTZ,
+    status VARCHAR(50) NOT NULL,
+    total_amount NUMERIC(10,2) NOT NULL,
+    item_count INTEGER NOT NULL,
+    items TEXT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS order_summary_user_id_idx ON order_summary (user_id);
+CREATE INDEX IF NOT EXISTS order_summary_order_number_idx ON order_summary (order_number);
+
+CREATE TABLE IF NOT EXISTS user_order_history (
+    user_id INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    order_count INTEGER NOT NULL,
+    total_spent NUMERIC(12,2) NOT NULL,
+    open_orders INTEGER NOT NULL,
+    last_order_id INTEGER,
+    last_order_number VARCHAR(255),
+    last_order_date TIMESTAMPTZ,
+    last_order_status VARCHAR(50),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# summaries a failed incremental refresh left stale, retried by sync.py
+PENDING_DDL = """
+CREATE TABLE IF NOT EXISTS support_views_pending (
+    table_name TEXT NOT NULL,  -- 'orders' or 'users'
+    id INTEGER NOT NULL,
+    PRIMARY KEY (table_name, id)
+);
+"""
+
+# {where} restricts the source rows; empty for a full rebuild
+ORDER_SUMMARY_SQL = """
+INSERT INTO order_summary (
+    order_id, order_number, user_id, order_date, status, total_amount, item_count, items
+)
+SELECT o.order_id, o.order_number, o.user_id, o.order_date, o.status, o.total_amount,
+       coalesce(sum(oi.quantity), 0),
+       string_agg(oi.quantity || ' x ' || p.name, '; ' ORDER BY oi.order_item_id)
+FROM orders o
+LEFT JOIN order_items oi ON oi.order_id = o.order_id
+LEFT JOIN products p ON p.product_id = oi.product_id
+{where}
+GROUP BY o.order_id
+ORDER BY o.order_id
+ON CONFLICT (order_id) DO UPDATE SET
+    order_number = EXCLUDED.order_number, user_id = EXCLUDED.user_id,
+    order_date = EXCLUDED.order_date, status = EXCLUDED.status,
+    total_amount = EXCLUDED.total_amount, item_count = EXCLUDED.item_count,
+    items = EXCLUDED.items, updated_at = now()
+"""
+
+USER_HISTORY_SQL = """
+INSERT INTO user_order_history (
+    user_id, name, order_count, total_spent, open_orders,
+    last_order_id, last_order_number, last_order_date, last_order_status
+)
+SELECT u.user_id, u.name,
+       count(o.order_id),
+       coalesce(sum(o.total_amount) FILTER (WHERE o.status <> 'cancelled'), 0),
+       count(o.order_id) FILTER (WHERE o.status IN ('pending', 'shipped')),
+       last.order_id, last.order_number, last.order_date, last.status
+FROM users u
+LEFT JOIN orders o ON o.user_id = u.user_id
+LEFT JOIN LATERAL (
+    SELECT order_id, order_number, order_date, status
+    FROM orders WHERE user_id = u.user_id
+    ORDER BY order_date DESC, order_id DESC
+    LIMIT 1
+) last ON true
+{where}
+GROUP BY u.user_id, last.order_id, last.order_number, last.order_date, last.status
+ORDER BY u.user_id
+ON CONFLICT (user_id) DO UPDATE SET
+    name = EXCLUDED.name, order_count = EXCLUDED.order_count,
+    total_spent = EXCLUDED.total_spent, open_orders = EXCLUDED.open_orders,
+    last_order_id = EXCLUDED.last_order_id, last_order_number = EXCLUDED.last_order_number,
+    last_order_date = EXCLUDED.last_order_date, last_order_status = EXCLUDED.last_order_status,
+    updated_at = now()
+"""
+
+# Prepended to the SQL chain's prompt when the tables exist
+PROMPT_HINT = """Prefer these precomputed tables, they answer most support questions without joins:
+- order_summary: one row per order with order_number, user_id, order_date, status, total_amount,
+  item_count and items (a readable "quantity x product name; ..." list).
+- user_order_history: one row per customer (user_id, name) with order_count, total_spent,
+  open_orders and their latest order's id, number, date and status.
+Only join the base tables when these don't have what is needed.
+
+"""
+
+
+def installed(conn):
+    return conn.execute("SELECT to_regclass('order_summary') IS NOT NULL").fetchone()[0]
+
+
+def refresh_orders(conn, order_ids):
+    """Recompute the summaries of these orders; returns the user_ids they belong(ed) to"""
+    if not order_ids:
+        return set()
+    ids = sorted(order_ids)
+    with conn.cursor() as cur:
+        cur.execute(ORDER_SUMMARY_SQL.format(where="WHERE o.order_id = ANY(%s)") + " RETURNING user_id", (ids,))
+        users = {row[0] for row in cur.fetchall()}
+        cur.execute("""
+            DELETE FROM order_summary s
+            WHERE s.order_id = ANY(%s)
+              AND NOT EXISTS (SELECT 1 FROM orders o WHERE o.order_id = s.order_id)
+            RETURNING user_id
+        """, (ids,))
+        users.update(row[0] for row in cur.fetchall())
+    return users - {None}
+
+
+def refresh_users(conn, user_ids):
+    if not user_ids:
+        return
+    ids = sorted(user_ids)
+    with conn.cursor() as cur:
+        cur.execute(USER_HISTORY_SQL.format(where="WHERE u.user_id = ANY(%s)"), (ids,))
+        cur.execute("""
+            DELETE FROM user_order_history h
+            WHERE h.user_id = ANY(%s)
+              AND NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = h.user_id)
+        """, (ids,))
+
+
+def affected(conn, entries):
+    """
+    (order_ids, user_ids) whose summaries a chunk of outbox entries can change.
+    Entries are (id, table, op, pk, changed, refs, created_at); refs carries
+    the old and new parent keys recorded by the trigger (user_id of orders,
+    order_id of order_items), so deleted rows still lead to their parents.
+    """
+    order_ids, user_ids, renamed_products = set(), set(), set()
+    for _, table_name, op, pk, changed, refs, _ in entries:
+        refs = refs or {}
+        if table_name == "orders":
+            order_ids.add(pk)
+            user_ids.update(refs.get("user_id", ()))
+        elif table_name == "order_items":
+            order_ids.update(refs.get("order_id", ()))
+        elif table_name == "users":
+            user_ids.add(pk)
+        elif table_name == "products" and op == "UPDATE" and "name" in (changed or ()):
+            renamed_products.add(pk)
+
+    if renamed_products:
+        rows = conn.execute(
+            "SELECT DISTINCT order_id FROM order_items WHERE product_id = ANY(%s)",
+            (sorted(renamed_products),)
+        ).fetchall()
+        order_ids.update(row[0] for row in rows)
+
+    return order_ids, user_ids
+
+
+def refresh(conn, order_ids, user_ids):
+    user_ids = set(user_ids) | refresh_orders(conn, order_ids)
+    refresh_users(conn, user_ids)
+    return len(order_ids), len(user_ids)
+
+
+def apply_changes(conn, entries):
+    """Refresh every summary row a chunk of outbox entries can affect"""
+    return refresh(conn, *affected(conn, entries))
+
+
+def mark_pending(conn, order_ids, user_ids):
+    with conn.cursor() as cur:
+        cur.execute(PENDING_DDL)
+        cur.executemany(
+            "INSERT INTO support_views_pending (table_name, id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+            [("orders", i) for i in sorted(order_ids)] + [("users", i) for i in sorted(user_ids)]
+        )
+
+
+def retry_pending(conn, limit=1000):
+    """Refresh summaries left stale by earlier failures; returns how many were retried"""
+    if conn.execute("SELECT to_regclass('support_views_pending')").fetchone()[0] is None:
+        return 0
+    # removed in the same transaction as the refresh, so a failure puts them back
+    rows = conn.execute("""
+        DELETE FROM support_views_pending
+        WHERE (table_name, id) IN (
+            SELECT table_name, id FROM support_views_pending LIMIT %s FOR UPDATE SKIP LOCKED
+        )
+        RETURNING table_name, id
+    """, (limit,)).fetchall()
+    refresh(
+        conn,
+        {row_id for table_name, row_id in rows if table_name == "orders"},
+        {row_id for table_name, row_id in rows if table_name == "users"},
+    )
+    return len(rows)
+
+
+def rebuild(conn):
+    with conn.cursor() as cur:
+        cur.execute(SUPPORT_VIEWS_DDL)
+        cur.execute(PENDING_DDL)
+        cur.execute("TRUNCATE order_summary, user_order_history, support_views_pending")
+        cur.execute(ORDER_SUMMARY_SQL.format(where=""))
+        print(f"Built {cur.rowcount} order summaries")
+        cur.execute(USER_HISTORY_SQL.format(where=""))
+        print(f"Built {cur.rowcount} user order histories")
+        cur.execute("ANALYZE order_summary")
+        cur.execute("ANALYZE user_order_history")
+    conn.commit()
+
+
+def main():
+    conn = get_connection()
+    try:
+        rebuild(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
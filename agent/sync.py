@@ -1,68 +1,656 @@
+import os
+import time
 import uuid
-import json
-import select
-from db import get_connection, update_last_sync_time
-from qdrant_setup import vectorstore
-
-TABLES = ["users", "orders", "products", "order_items"]
-PRIMARY_KEYS = {
-    "users": "user_id",
-    "orders": "order_id",
-    "products": "product_id",
-    "order_items": "order_item_id"
-}
+import signal
+import asyncio
+from psycopg import sql
+from psycopg.types.json import Jsonb
+from qdrant_client.models import (
+    PointIdsList, PointStruct, SetPayload, SetPayloadOperation, Filter, FieldCondition, MatchValue,
+)
+from db import get_connection, get_async_connection, update_last_sync_time
+from qdrant_setup import qdrant, COLLECTION_NAME
+from documents import (
+    NO_SALES, ROW_HASH_SQL, SKIP_COLS, build_document, compute_popularity,
+    point_id_for, searchable_payload,
+)
+from token_batching import EMBEDDING_MODEL, token_batches
+from openai_client import BATCH, embeddings_model
+from triggers import TRIGGER_TABLES, OUTBOX_CHANNEL
+from sync_metrics import metrics, serve
+import support_views
+
+PRIMARY_KEYS = TRIGGER_TABLES
+TABLES = list(PRIMARY_KEYS)
 
 BATCH_SIZE = 100  # batch size for Qdrant inserts
+# after a wake-up, let a burst of changes accumulate this many seconds before claiming
+FLUSH_INTERVAL = float(os.getenv("SYNC_FLUSH_INTERVAL", "0.5"))
+# concurrent embed/upsert workers in this process, each with its own DB connection.
+# Any number of sync.py processes can run side by side, on one host or many.
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "4"))
+OUTBOX_BATCH = 1000  # outbox entries applied per partition claim
+# a partition lease is renewed before every batch; a worker that died mid-claim
+# loses its partition to another worker after this many seconds
+LEASE_SECONDS = float(os.getenv("SYNC_LEASE_SECONDS", "300"))
+POLL_INTERVAL = 5  # seconds to wait for a wake-up before polling the outbox anyway
+SYNC_RETRIES = 3
+# seconds between drift checks against Postgres, 0 disables them
+RECONCILE_INTERVAL = float(os.getenv("SYNC_RECONCILE_INTERVAL", "3600"))
+RECONCILE_CHUNK = 1000
+RECONCILE_LOCK = 7_202_033  # advisory lock key, one reconciler across all processes
+# health/metrics endpoint, 0 disables it
+METRICS_PORT = int(os.getenv("SYNC_METRICS_PORT", "8008"))
+METRICS_HOST = os.getenv("SYNC_METRICS_HOST", "0.0.0.0")
+# /health reports unhealthy once the oldest unapplied change is older than this
+MAX_LAG = float(os.getenv("SYNC_MAX_LAG", "60"))
+BACKLOG_INTERVAL = 5  # seconds between outbox backlog checks
+# a dropped LISTEN connection is reopened after 1s, doubling up to this many seconds
+LISTEN_MAX_BACKOFF = float(os.getenv("SYNC_LISTEN_MAX_BACKOFF", "60"))
+
+# re-embedding is background work, it yields to the live agent's calls
+embeddings = embeddings_model(BATCH, model=EMBEDDING_MODEL)
 
 # Helper function to batch a list
 def batch_list(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
-# Sync a single row to Qdrant
-def sync_row(table_name, row_dict):
+# Combine a new change with the one already buffered for the same row
+def merge_change(prev, op, changed):
+    if prev is None or op in ("INSERT", "DELETE"):
+        return op, set(changed or ())
+    prev_op, prev_changed = prev
+    if prev_op == "INSERT":
+        # still a new row as far as Qdrant is concerned
+        return "INSERT", set()
+    if prev_op == "DELETE":
+        return op, set(changed or ())
+    return "UPDATE", prev_changed | set(changed or ())
+
+# Sales figures of a product change with its order_items and with the status or
+# date of their orders. sync.py queues a products entry carrying this pseudo
+# column for each affected product, which refreshes the payload only.
+POPULARITY_CHANGE = "popularity"
+POPULARITY_ORDER_COLS = {"status", "order_date"}
+
+# Does this change need a new embedding, or only a payload update?
+def classify_change(op, changed):
+    if op == "DELETE":
+        return "delete"
+    if op == "INSERT" or not changed <= SKIP_COLS | {POPULARITY_CHANGE}:
+        return "embed"
+    # structured fields and the row hash still change, so the payload is always refreshed
+    return "payload"
+
+# Re-embed and upsert a batch of rows of one table
+def sync_rows(conn, table_name, rows):
     pk_column = PRIMARY_KEYS[table_name]
-    row_id = row_dict[pk_column]
+    row_ids = [row[pk_column] for row in rows]
+
+    popularity = {}
+    if table_name == "products":
+        with conn.cursor() as cur:
+            popularity = compute_popularity(cur, product_ids=row_ids)
+
+    docs = [build_document(table_name, pk_column, row_dict, popularity) for row_dict in rows]
+    for texts, metadatas, ids, tokens in token_batches(docs):
+        # embed and upsert separately so each gets its own latency series;
+        # the payload layout is the one QdrantVectorStore.add_texts writes
+        with metrics.timer("embed_seconds"):
+            vectors = embeddings.embed_documents(texts)
+        with metrics.timer("upsert_seconds"):
+            qdrant.upsert(
+                collection_name=COLLECTION_NAME,
+                points=[
+                    PointStruct(id=point_id, vector=vector,
+                                payload={"page_content": text, "metadata": metadata})
+                    for point_id, vector, text, metadata in zip(ids, vectors, texts, metadatas)
+                ],
+            )
+        metrics.increment("embedded_rows", len(texts))
+        metrics.increment("embedded_tokens", tokens)
+    print(f"Synced {len(rows)} {table_name} rows {row_ids}")
+
+# Update only the structured metadata of existing points, no embedding call.
+# set_payload on a missing point fails the whole batch, so those rows are
+# returned for a full re-embed instead.
+def update_payloads(conn, table_name, rows):
+    pk_column = PRIMARY_KEYS[table_name]
+    point_ids = [point_id_for(table_name, row_dict[pk_column]) for row_dict in rows]
+    existing = {
+        str(point.id) for point in qdrant.retrieve(
+            collection_name=COLLECTION_NAME, ids=point_ids, with_payload=False, with_vectors=False
+        )
+    }
+    present = [row_dict for row_dict, point_id in zip(rows, point_ids) if point_id in existing]
+    missing = [row_dict for row_dict, point_id in zip(rows, point_ids) if point_id not in existing]
+
+    payloads = [searchable_payload(row_dict) for row_dict in present]
+    if table_name == "products" and present:
+        # sales figures too, so queued popularity refreshes land here
+        with conn.cursor() as cur:
+            popularity = compute_popularity(cur, product_ids=[row_dict[pk_column] for row_dict in present])
+        for row_dict, payload in zip(present, payloads):
+            payload.update(popularity.get(row_dict[pk_column], NO_SALES))
+
+    operations = [
+        SetPayloadOperation(set_payload=SetPayload(
+            payload=payload,
+            points=[point_id_for(table_name, row_dict[pk_column])],
+            key="metadata",
+        ))
+        for row_dict, payload in zip(present, payloads)
+    ]
+    if operations:
+        with metrics.timer("payload_update_seconds"):
+            qdrant.batch_update_points(collection_name=COLLECTION_NAME, update_operations=operations)
+        metrics.increment("payload_updated_rows", len(present))
+        print(f"Updated payload of {len(present)} {table_name} rows")
+    return missing
+
+def delete_points(table_name, row_ids):
+    with metrics.timer("delete_seconds"):
+        qdrant.delete(
+            collection_name=COLLECTION_NAME,
+            points_selector=PointIdsList(points=[point_id_for(table_name, row_id) for row_id in row_ids]),
+        )
+    metrics.increment("deleted_rows", len(row_ids))
+    print(f"Deleted {len(row_ids)} {table_name} rows {row_ids}")
+
+# Fetch the current version of changed rows, one query per batch
+def fetch_rows(conn, table_name, row_ids):
+    pk_column = PRIMARY_KEYS[table_name]
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("SELECT t.*, {} FROM {} t WHERE {} = ANY(%s)")
+            .format(sql.SQL(ROW_HASH_SQL), sql.Identifier(table_name), sql.Identifier(pk_column)),
+            (list(row_ids),)
+        )
+        colnames = [desc[0] for desc in cur.description]
+        return [dict(zip(colnames, row)) for row in cur.fetchall()]
+
+# Apply one batch of changes to a single table; raises if anything fails
+def sync_table_batch(conn, table_name, changes):
+    pk_column = PRIMARY_KEYS[table_name]
+    actions = {row_id: classify_change(op, changed) for row_id, (op, changed) in changes}
+
+    to_delete = [row_id for row_id, action in actions.items() if action == "delete"]
+    to_fetch = [row_id for row_id, action in actions.items() if action in ("embed", "payload")]
+
+    to_embed, to_update = [], []
+    if to_fetch:
+        rows = fetch_rows(conn, table_name, to_fetch)
+        for row_dict in rows:
+            if actions[row_dict[pk_column]] == "embed":
+                to_embed.append(row_dict)
+            else:
+                to_update.append(row_dict)
+        # deleted before we got to them
+        found = {row_dict[pk_column] for row_dict in rows}
+        to_delete += [row_id for row_id in to_fetch if row_id not in found]
+
+    if to_delete:
+        delete_points(table_name, to_delete)
+    if to_update:
+        # rows without a point yet (never embedded, or lost) get embedded instead
+        to_embed += update_payloads(conn, table_name, to_update)
+    if to_embed:
+        sync_rows(conn, table_name, to_embed)
+    update_last_sync_time(table_name)
+
+# Select one chunk of a table in primary key order, after last_pk
+def select_chunk(conn, table_name, columns, last_pk):
+    pk_column = PRIMARY_KEYS[table_name]
+    where = sql.SQL("")
+    params = []
+    if last_pk is not None:
+        where = sql.SQL("WHERE {} > %s").format(sql.Identifier(pk_column))
+        params.append(last_pk)
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("SELECT {} FROM {} t {} ORDER BY {} LIMIT %s").format(
+                sql.SQL(columns), sql.Identifier(table_name), where, sql.Identifier(pk_column)
+            ),
+            params + [RECONCILE_CHUNK]
+        )
+        return cur.fetchall()
+
+# Compare row hashes against point payloads; returns repair changes for drifted rows
+def reconcile_table(conn, table_name):
+    pk_column = PRIMARY_KEYS[table_name]
+    repairs = []
+
+    # rows whose point is missing or carries a stale hash get re-embedded
+    last_pk = None
+    while True:
+        rows = select_chunk(conn, table_name, f"{pk_column}, {ROW_HASH_SQL}", last_pk)
+        if not rows:
+            break
+        points = qdrant.retrieve(
+            collection_name=COLLECTION_NAME,
+            ids=[point_id_for(table_name, row_id) for row_id, _ in rows],
+            with_payload=["metadata.row_hash"],
+        )
+        point_hashes = {
+            str(point.id): (point.payload or {}).get("metadata", {}).get("row_hash")
+            for point in points
+        }
+        for row_id, row_hash in rows:
+            if point_hashes.get(point_id_for(table_name, row_id)) != row_hash:
+                repairs.append({"table": table_name, "op": "INSERT", "pk": row_id})
+        last_pk = rows[-1][0]
+
+    # points whose row no longer exists get deleted
+    offset = None
+    while True:
+        points, offset = qdrant.scroll(
+            collection_name=COLLECTION_NAME,
+            scroll_filter=Filter(must=[
+                FieldCondition(key="metadata.table", match=MatchValue(value=table_name))
+            ]),
+            limit=RECONCILE_CHUNK,
+            offset=offset,
+            with_payload=["metadata.primary_key"],
+        )
+        point_pks = [
+            (point.payload or {}).get("metadata", {}).get("primary_key") for point in points
+        ]
+        point_pks = [pk for pk in point_pks if pk is not None]
+        if point_pks:
+            found = {row_dict[pk_column] for row_dict in fetch_rows(conn, table_name, point_pks)}
+            repairs += [
+                {"table": table_name, "op": "DELETE", "pk": pk}
+                for pk in point_pks if pk not in found
+            ]
+        if offset is None:
+            break
+
+    return repairs
+
+# Products whose sales figures a chunk of outbox entries can change. refs carries
+# the old and new product_id of order_items; entries written before the trigger
+# recorded it are looked up by primary key (deleted items are then missed).
+def popularity_products(conn, entries):
+    product_ids, order_ids, item_ids = set(), set(), set()
+    for _, table_name, op, pk, changed, refs, _ in entries:
+        if table_name == "order_items":
+            if refs and "product_id" in refs:
+                product_ids.update(refs["product_id"])
+            else:
+                item_ids.add(pk)
+        elif table_name == "orders" and op == "UPDATE" and POPULARITY_ORDER_COLS & set(changed or ()):
+            order_ids.add(pk)
+
+    if order_ids or item_ids:
+        rows = conn.execute(
+            "SELECT DISTINCT product_id FROM order_items "
+            "WHERE order_id = ANY(%s) OR order_item_id = ANY(%s)",
+            (sorted(order_ids), sorted(item_ids))
+        ).fetchall()
+        product_ids.update(row[0] for row in rows)
+    return product_ids
+
+# Queue repairs through the outbox, so they are applied in order with live changes
+def enqueue_repairs(conn, repairs):
+    with conn.cursor() as cur:
+        cur.executemany(
+            "INSERT INTO sync_outbox (table_name, op, pk) VALUES (%s, %s, %s)",
+            [(repair["table"], repair["op"], Jsonb(repair["pk"])) for repair in repairs]
+        )
+        cur.execute(f"NOTIFY {OUTBOX_CHANNEL};")
+
+# Periodically repair drift between Postgres and Qdrant without a full reindex
+async def run_reconciler():
+    conn = await asyncio.to_thread(get_connection, True)
+    try:
+        while True:
+            await asyncio.sleep(RECONCILE_INTERVAL)
+            # only one process reconciles at a time
+            locked = await asyncio.to_thread(
+                lambda: conn.execute("SELECT pg_try_advisory_lock(%s)", (RECONCILE_LOCK,)).fetchone()[0]
+            )
+            if not locked:
+                continue
+            try:
+                for table_name in TABLES:
+                    repairs = await asyncio.to_thread(reconcile_table, conn, table_name)
+                    if repairs:
+                        print(f"Reconciliation found {len(repairs)} drifted {table_name} rows")
+                        await asyncio.to_thread(enqueue_repairs, conn, repairs)
+            finally:
+                await asyncio.to_thread(conn.execute, "SELECT pg_advisory_unlock(%s)", (RECONCILE_LOCK,))
+    finally:
+        conn.close()
+
+
+# Partition state lives in sync_state as 'partition-<n>' rows. A worker leases
+# one partition in a short transaction, applies its oldest entries with no
+# transaction open, then deletes exactly those entries and releases the lease.
+# Outbox ids are handed out at insert time but committed in any order, so a
+# lower id can become visible after higher ones were applied; deleting by id
+# instead of behind a high-water mark means such an entry is simply picked up
+# by the next claim.
+CLAIM_SQL = """
+    SELECT s.consumer
+    FROM sync_state s
+    WHERE s.consumer LIKE 'partition-%'
+      AND (s.leased_until IS NULL OR s.leased_until < now())
+      AND EXISTS (
+          SELECT 1 FROM sync_outbox o
+          WHERE o.partition_id = split_part(s.consumer, '-', 2)::int
+      )
+    ORDER BY s.updated_at
+    LIMIT 1
+    FOR UPDATE OF s SKIP LOCKED
+"""
 
-    point_id = uuid.uuid5(uuid.NAMESPACE_DNS, f"{table_name}_{row_id}")
-    texts = [json.dumps(row_dict)]
-    metadatas = [{"table": table_name, "pk": row_id}]
-    ids = [point_id]
+LEASE_SQL = """
+    UPDATE sync_state SET leased_by = %s, leased_until = now() + make_interval(secs => %s)
+    WHERE consumer = %s
+"""
 
+# Outbox entries -> {table: [(pk, change)]}, repeated changes to a row collapsed into one
+def coalesce(entries):
+    buffer = {}
+    for _, table_name, op, pk, changed, _, _ in entries:
+        key = (table_name, pk)
+        buffer[key] = merge_change(buffer.pop(key, None), op, changed)
+    by_table = {}
+    for (table_name, pk), change in buffer.items():
+        by_table.setdefault(table_name, []).append((pk, change))
+    return by_table
+
+# Runs outside any transaction: the connection is in autocommit mode, so no
+# snapshot or lock is held across embedding calls, upserts and backoff.
+# Returns whether the batch was applied.
+def apply_with_retries(conn, table_name, changes):
+    for attempt in range(1, SYNC_RETRIES + 1):
+        try:
+            sync_table_batch(conn, table_name, changes)
+            return True
+        except Exception as e:
+            metrics.increment("errors")
+            row_ids = [row_id for row_id, _ in changes]
+            if attempt == SYNC_RETRIES:
+                # move on; the next reconciliation repairs these rows
+                metrics.increment("failed_batches")
+                print(f"Failed to sync {table_name} rows {row_ids}: {e}")
+                return False
+            else:
+                print(f"Retrying {table_name} rows {row_ids} after error: {e}")
+                time.sleep(2 ** attempt)
+
+# Keep the support summary tables in step with the same entries, when they are
+# installed. A failed refresh is recorded in support_views_pending and retried
+# with later claims. Returns False when not even that worked, so the caller
+# keeps the entries in the outbox.
+def refresh_support_views(conn, entries):
     try:
-        vectorstore.add_texts(texts=texts, metadatas=metadatas, ids=ids)
-        update_last_sync_time(table_name)
-        print(f"Synced {table_name} row {row_id}")
+        with conn.transaction():
+            if not support_views.installed(conn):
+                return True
+            order_ids, user_ids = support_views.affected(conn, entries)
     except Exception as e:
-        print(f"Failed to sync {table_name} row {row_id}: {e}")
+        metrics.increment("errors")
+        print(f"Failed to find support views to refresh: {e}")
+        return False
 
-# Main sync listener
-def main():
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Listen to all table channels
-    for table_name in TABLES:
-        cursor.execute(f"LISTEN {table_name}_changed;")
-    print("Sync agent listening for changes. Press Ctrl+C to stop.")
+    try:
+        with conn.transaction():
+            with metrics.timer("views_seconds"):
+                orders, users = support_views.refresh(conn, order_ids, user_ids)
+        metrics.increment("view_rows", orders + users)
+    except Exception as e:
+        metrics.increment("errors")
+        print(f"Failed to refresh support views, queued for retry: {e}")
+        try:
+            with conn.transaction():
+                support_views.mark_pending(conn, order_ids, user_ids)
+        except Exception as e:
+            print(f"Failed to queue support views for retry: {e}")
+            return False
+        return True
 
+    try:
+        with conn.transaction():
+            retried = support_views.retry_pending(conn)
+        if retried:
+            metrics.increment("view_rows", retried)
+            print(f"Refreshed {retried} support view rows left stale by earlier failures")
+    except Exception as e:
+        metrics.increment("errors")
+        print(f"Failed to retry stale support views: {e}")
+    return True
+
+# Lease one partition with pending entries; returns (consumer, token, entries) or None
+def claim_partition(conn):
+    token = uuid.uuid4().hex
+    with conn.transaction():
+        claimed = conn.execute(CLAIM_SQL).fetchone()
+        if claimed is None:
+            return None
+        consumer = claimed[0]
+        partition_id = int(consumer.rsplit("-", 1)[1])
+        conn.execute(LEASE_SQL, (token, LEASE_SECONDS, consumer))
+        entries = conn.execute(
+            "SELECT id, table_name, op, pk, changed, refs, created_at FROM sync_outbox "
+            "WHERE partition_id = %s ORDER BY id LIMIT %s",
+            (partition_id, OUTBOX_BATCH)
+        ).fetchall()
+    return consumer, token, entries
+
+# False once another worker has taken the partition over
+def renew_lease(conn, consumer, token):
+    cur = conn.execute(
+        "UPDATE sync_state SET leased_until = now() + make_interval(secs => %s) "
+        "WHERE consumer = %s AND leased_by = %s",
+        (LEASE_SECONDS, consumer, token)
+    )
+    return cur.rowcount == 1
+
+# Hand the partition back, drop the applied entries and queue the popularity
+# refreshes they call for, committed together. Nothing is deleted if the lease
+# is gone: the new holder owns those entries.
+def release_partition(conn, consumer, token, entry_ids, product_ids=()):
+    with conn.transaction():
+        cur = conn.execute(
+            "UPDATE sync_state SET leased_by = NULL, leased_until = NULL, updated_at = now() "
+            "WHERE consumer = %s AND leased_by = %s",
+            (consumer, token)
+        )
+        if cur.rowcount != 1:
+            return False
+        conn.execute("DELETE FROM sync_outbox WHERE id = ANY(%s)", (entry_ids,))
+        if product_ids:
+            with conn.cursor() as cur:
+                cur.executemany(
+                    "INSERT INTO sync_outbox (table_name, op, pk, changed) VALUES ('products', 'UPDATE', %s, %s)",
+                    [(Jsonb(product_id), [POPULARITY_CHANGE]) for product_id in sorted(product_ids)]
+                )
+                cur.execute(f"NOTIFY {OUTBOX_CHANNEL};")
+    return True
+
+def lease_lost(consumer):
+    metrics.increment("lost_leases")
+    print(f"Lease on {consumer} expired and was taken over, abandoning the claim")
+
+# Claim one partition with pending entries and apply its oldest chunk in order.
+# Returns the number of entries applied, 0 when there was nothing to claim.
+def claim_and_process(conn):
+    claimed = claim_partition(conn)
+    if claimed is None:
+        return 0
+    consumer, token, entries = claimed
+    metrics.observe("claim_entries", len(entries))
+
+    # on a lost lease, stop at once: the new holder applies these entries again
+    # (upserts and deletes are idempotent) and nothing here is released
+    failed = set()
+    for table_name, changes in coalesce(entries).items():
+        for chunk in batch_list(changes, BATCH_SIZE):
+            if not renew_lease(conn, consumer, token):
+                lease_lost(consumer)
+                return 0
+            metrics.observe("batch_rows", len(chunk))
+            if not apply_with_retries(conn, table_name, chunk):
+                failed.update((table_name, row_id) for row_id, _ in chunk)
+    if not renew_lease(conn, consumer, token):
+        lease_lost(consumer)
+        return 0
+    views_ok = refresh_support_views(conn, entries)
+
+    # the entries stay in the outbox when the support views could not be brought
+    # up to date, the next claim applies them again
+    entry_ids, product_ids = [], set()
+    if views_ok:
+        try:
+            product_ids = popularity_products(conn, entries)
+            entry_ids = [entry[0] for entry in entries]
+        except Exception as e:
+            # like a failed view refresh: keep the entries and apply them again
+            metrics.increment("errors")
+            print(f"Failed to find products for popularity refresh: {e}")
+            views_ok = False
+    if not release_partition(conn, consumer, token, entry_ids, product_ids):
+        lease_lost(consumer)
+        return 0
+    if product_ids:
+        metrics.increment("popularity_refreshes", len(product_ids))
+
+    # end-to-end lag: change written in Postgres -> applied in Qdrant. created_at
+    # is the trigger's clock_timestamp() when the row changed, not commit time,
+    # so long transactions add to it. Only entries applied now count.
+    if views_ok:
+        now = time.time()
+        applied = [entry for entry in entries if (entry[1], entry[3]) not in failed]
+        for entry in applied:
+            metrics.observe("lag_seconds", now - entry[-1].timestamp())
+        metrics.increment("applied_entries", len(applied))
+
+    # back off like an idle worker instead of claiming the same entries right away
+    return len(entries) if views_ok else 0
+
+
+class Wakeup:
+    """Lets idle workers sleep until the outbox trigger fires"""
+
+    def __init__(self):
+        self.generation = 0
+        self._cond = asyncio.Condition()
+
+    async def notify(self):
+        async with self._cond:
+            self.generation += 1
+            self._cond.notify_all()
+
+    async def wait(self, seen, timeout):
+        async with self._cond:
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self.generation != seen), timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+
+# Outbox backlog: how many changes wait and how old the oldest one is
+async def watch_backlog():
+    conn = await get_async_connection()
     try:
         while True:
-            # Wait for notifications
-            if select.select([conn], [], [], 5) == ([], [], []):
-                continue
-            conn.poll()
-            while conn.notifies:
-                notify = conn.notifies.pop(0)
-                payload = json.loads(notify.payload)
-                table = notify.channel.replace("_changed", "")
-                sync_row(table, payload)
-    except KeyboardInterrupt:
-        print("\nSync agent stopped by user.")
+            cur = await conn.execute(
+                "SELECT count(*), extract(epoch FROM now() - min(created_at)) FROM sync_outbox"
+            )
+            pending, oldest_age = await cur.fetchone()
+            metrics.set_gauge("outbox_pending", pending)
+            metrics.set_gauge("oldest_pending_age_seconds", round(float(oldest_age or 0), 3))
+            await asyncio.sleep(BACKLOG_INTERVAL)
+    finally:
+        await conn.close()
+
+# Receive stage: trigger notifications only wake idle workers up. Workers
+# poll every POLL_INTERVAL anyway, so a dropped connection only costs latency
+# while it is reopened.
+class Listener:
+    def __init__(self, wakeup):
+        self.wakeup = wakeup
+        self.connected = False
+
+    async def run(self):
+        delay = 1.0
+        while True:
+            try:
+                conn = await get_async_connection()
+                try:
+                    await conn.execute(f"LISTEN {OUTBOX_CHANNEL};")
+                    self.connected = True
+                    delay = 1.0
+                    # catch up on whatever changed while disconnected
+                    await self.wakeup.notify()
+                    async for _ in conn.notifies():
+                        await self.wakeup.notify()
+                finally:
+                    self.connected = False
+                    await conn.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.increment("listener_reconnects")
+                print(f"Listener connection lost ({e}), reconnecting in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LISTEN_MAX_BACKOFF)
+
+# Process stage: claim partitions and apply their entries until told to stop
+async def run_worker(wakeup, stop):
+    # autocommit, so each claim_and_process transaction block is its own transaction
+    conn = await asyncio.to_thread(get_connection, True)
+    try:
+        while not stop.is_set():
+            seen = wakeup.generation
+            processed = await asyncio.to_thread(claim_and_process, conn)
+            if processed == 0 and wakeup.generation == seen:
+                await wakeup.wait(seen, POLL_INTERVAL)
+                if not stop.is_set():
+                    await asyncio.sleep(FLUSH_INTERVAL)
     finally:
-        cursor.close()
         conn.close()
-        print("Database connection closed.")
+
+# Main sync service
+async def run():
+    stop = asyncio.Event()
+    wakeup = Wakeup()
+    workers = [asyncio.create_task(run_worker(wakeup, stop)) for _ in range(SYNC_WORKERS)]
+    listener = Listener(wakeup)
+    background = [asyncio.create_task(listener.run()), asyncio.create_task(watch_backlog())]
+    if RECONCILE_INTERVAL > 0:
+        background.append(asyncio.create_task(run_reconciler()))
+
+    def health():
+        lag = metrics.snapshot()["gauges"].get("oldest_pending_age_seconds", 0)
+        ok = listener.connected and lag <= MAX_LAG
+        return ok, {"listener_alive": listener.connected, "max_lag_seconds": MAX_LAG}
+
+    if METRICS_PORT:
+        background.append(asyncio.create_task(serve(health, METRICS_HOST, METRICS_PORT)))
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    print(f"Sync agent following the outbox with {SYNC_WORKERS} workers. Press Ctrl+C to stop.")
+
+    await stop.wait()
+    print("\nSync agent stopping, finishing in-flight partitions...")
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+
+    # graceful shutdown: claimed chunks are applied and committed before exit
+    await wakeup.notify()
+    await asyncio.gather(*workers)
+    print("Sync agent stopped.")
+
+def main():
+    asyncio.run(run())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,113 @@
+import json
+import time
+import asyncio
+import threading
+from series import Series
+
+
+class SyncMetrics:
+    """
+    Sync service metrics. Workers update them from threads, the HTTP endpoint
+    reads them from the event loop, so every access goes through one lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.series = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, value):
+        with self._lock:
+            self.series.setdefault(name, Series()).observe(value)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started, 1),
+                "gauges": dict(self.gauges),
+                "counters": dict(self.counters),
+                "series": {name: series.summary() for name, series in self.series.items()},
+            }
+
+    def prometheus(self):
+        snap = self.snapshot()
+        lines = [f"sync_uptime_seconds {snap['uptime_seconds']}"]
+        for name, value in snap["gauges"].items():
+            lines.append(f"sync_{name} {value}")
+        for name, value in snap["counters"].items():
+            lines.append(f"sync_{name}_total {value}")
+        for name, summary in snap["series"].items():
+            lines.append(f"sync_{name}_count {summary['count']}")
+            for key in ("avg", "p50", "p95", "max"):
+                lines.append(f'sync_{name}{{stat="{key}"}} {summary[key]}')
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.monotonic() - self.start)
+
+
+metrics = SyncMetrics()
+
+
+async def serve(health, host, port):
+    """
+    Minimal HTTP endpoint: /health returns JSON (503 when unhealthy), /metrics
+    returns Prometheus text. health() -> (ok, details dict).
+    """
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            # skip the headers, nothing in them matters here
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            path = parts[1] if len(parts) > 1 else "/"
+
+            if path == "/metrics":
+                status, content_type = 200, "text/plain; version=0.0.4"
+                body = metrics.prometheus()
+            elif path == "/health":
+                ok, details = health()
+                status, content_type = (200 if ok else 503), "application/json"
+                body = json.dumps({"status": "ok" if ok else "unhealthy", **details, **metrics.snapshot()})
+            else:
+                status, content_type, body = 404, "text/plain", "not found\n"
+
+            data = body.encode()
+            reason = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}[status]
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Sync metrics on http://{host}:{port}/metrics and /health")
+    async with server:
+        await server.serve_forever()
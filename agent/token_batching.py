@@ -0,0 +1,52 @@
+import os
+import tiktoken
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# OpenAI embedding limits: tokens per input, tokens per request, inputs per request
+MAX_INPUT_TOKENS = int(os.getenv("EMBED_MAX_INPUT_TOKENS", "8191"))
+MAX_REQUEST_TOKENS = int(os.getenv("EMBED_MAX_REQUEST_TOKENS", "300000"))
+MAX_REQUEST_ITEMS = int(os.getenv("EMBED_MAX_REQUEST_ITEMS", "2048"))
+
+_encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+
+def count_tokens(text: str) -> int:
+    return len(_encoding.encode(text or ""))
+
+
+def truncate_text(text: str, max_tokens: int = MAX_INPUT_TOKENS):
+    """
+    Cut text to its first max_tokens tokens. Returns (text, token_count).
+    Always keeps the head of the row, so the same row truncates the same way every time.
+    """
+    tokens = _encoding.encode(text or "")
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+    return _encoding.decode(tokens[:max_tokens]), max_tokens
+
+
+def token_batches(docs, max_tokens=MAX_REQUEST_TOKENS, max_items=MAX_REQUEST_ITEMS):
+    """
+    Pack (text, metadata, point_id) docs into embedding requests.
+    Yields (texts, metadatas, ids, tokens) with each request under both the
+    token and the item limit. Oversized texts are truncated, never dropped.
+    """
+    texts, metadatas, ids = [], [], []
+    batch_tokens = 0
+
+    for text, metadata, point_id in docs:
+        text, n_tokens = truncate_text(text)
+
+        if texts and (batch_tokens + n_tokens > max_tokens or len(texts) >= max_items):
+            yield texts, metadatas, ids, batch_tokens
+            texts, metadatas, ids = [], [], []
+            batch_tokens = 0
+
+        texts.append(text)
+        metadatas.append(metadata)
+        ids.append(point_id)
+        batch_tokens += n_tokens
+
+    if texts:
+        yield texts, metadatas, ids, batch_tokens
@@ -0,0 +1,143 @@
+import os
+from db import get_connection
+
+# tables watched by sync.py and their primary keys
+TRIGGER_TABLES = {
+    "users": "user_id",
+    "orders": "order_id",
+    "products": "product_id",
+    "order_items": "order_item_id",
+}
+
+# parent keys recorded with each change (old and new values), so consumers can
+# find the rows a change affects even after a DELETE (see support_views.py and
+# the popularity refreshes in sync.py)
+REFERENCE_KEYS = {
+    "orders": ["user_id"],
+    "order_items": ["order_id", "product_id"],
+}
+
+# channel used to wake sync.py up when new outbox rows are committed
+OUTBOX_CHANNEL = "sync_outbox"
+
+# Rows are spread over this many partitions by a hash of table and primary key.
+# Each partition is applied in order by one worker at a time; changing it needs a
+# rerun of this script.
+SYNC_PARTITIONS = int(os.getenv("SYNC_PARTITIONS", "16"))
+
+# Durable change log. Every change is written in the same transaction as the row
+# itself, so nothing is lost while sync.py is down. Entries stay in the outbox
+# until they are applied; sync_state holds the lease of each partition.
+OUTBOX_DDL = f"""
+CREATE TABLE IF NOT EXISTS sync_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    op TEXT NOT NULL,
+    pk JSONB NOT NULL,
+    changed TEXT[],
+    created_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
+
+ALTER TABLE sync_outbox ADD COLUMN IF NOT EXISTS refs JSONB;
+
+ALTER TABLE sync_outbox DROP COLUMN IF EXISTS partition_id;
+ALTER TABLE sync_outbox ADD COLUMN partition_id INTEGER NOT NULL GENERATED ALWAYS AS (
+    (hashtext(table_name || ':' || pk::text) & 2147483647) % {SYNC_PARTITIONS}
+) STORED;
+CREATE INDEX IF NOT EXISTS sync_outbox_partition_idx ON sync_outbox (partition_id, id);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    consumer TEXT PRIMARY KEY,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- one lease per partition. Entries are deleted by id once applied, so there is
+-- no position to carry over when the partition count changes.
+ALTER TABLE sync_state DROP COLUMN IF EXISTS last_outbox_id;
+ALTER TABLE sync_state ADD COLUMN IF NOT EXISTS leased_by TEXT;
+ALTER TABLE sync_state ADD COLUMN IF NOT EXISTS leased_until TIMESTAMPTZ;
+INSERT INTO sync_state (consumer)
+SELECT 'partition-' || n FROM generate_series(0, {SYNC_PARTITIONS - 1}) n
+ON CONFLICT (consumer) DO NOTHING;
+DELETE FROM sync_state
+WHERE CASE WHEN consumer ~ '^partition-[0-9]+$'
+           THEN split_part(consumer, '-', 2)::int >= {SYNC_PARTITIONS}
+           ELSE true END;
+"""
+
+# Records only table, operation, primary key, for UPDATE the names of the
+# changed columns, and the parent keys passed as extra trigger arguments, so
+# entries stay tiny. sync.py fetches the rows itself.
+NOTIFY_FUNCTION = """
+CREATE OR REPLACE FUNCTION notify_row_change() RETURNS trigger AS $$
+DECLARE
+    rec jsonb;
+    changed text[];
+    refs jsonb := '{}';
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        rec := to_jsonb(OLD);
+    ELSE
+        rec := to_jsonb(NEW);
+    END IF;
+
+    -- names of the columns an UPDATE actually changed
+    IF TG_OP = 'UPDATE' THEN
+        SELECT coalesce(array_agg(n.key), '{}') INTO changed
+        FROM jsonb_each(rec) n
+        WHERE to_jsonb(OLD) -> n.key IS DISTINCT FROM n.value;
+
+        IF cardinality(changed) = 0 THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    -- {key: [old and new values]} for each parent key argument
+    FOR i IN 1 .. TG_NARGS - 1 LOOP
+        refs := refs || jsonb_build_object(TG_ARGV[i], (
+            SELECT coalesce(jsonb_agg(DISTINCT v), '[]')
+            FROM (VALUES (CASE WHEN TG_OP = 'UPDATE' THEN to_jsonb(OLD) -> TG_ARGV[i] END),
+                         (rec -> TG_ARGV[i])) x(v)
+            WHERE v IS NOT NULL AND v <> 'null'::jsonb
+        ));
+    END LOOP;
+
+    INSERT INTO sync_outbox (table_name, op, pk, changed, refs)
+    VALUES (TG_TABLE_NAME, TG_OP, rec -> TG_ARGV[0], changed, NULLIF(refs, '{}'));
+
+    -- only a wake-up call, delivered on commit and collapsed per transaction
+    PERFORM pg_notify('sync_outbox', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+TRIGGER_DDL = """
+DROP TRIGGER IF EXISTS {table}_notify_change ON {table};
+CREATE TRIGGER {table}_notify_change
+AFTER INSERT OR UPDATE OR DELETE ON {table}
+FOR EACH ROW EXECUTE FUNCTION notify_row_change({args});
+"""
+
+
+def install_triggers(conn):
+    with conn.cursor() as cur:
+        cur.execute(OUTBOX_DDL)
+        cur.execute(NOTIFY_FUNCTION)
+        for table, pk in TRIGGER_TABLES.items():
+            args = ", ".join(f"'{key}'" for key in [pk, *REFERENCE_KEYS.get(table, [])])
+            cur.execute(TRIGGER_DDL.format(table=table, args=args))
+            print(f"Installed change trigger on {table}")
+    conn.commit()
+
+
+def main():
+    conn = get_connection()
+    try:
+        install_triggers(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()